@@ -50,6 +50,18 @@ __contributors__ = {}
 __url__ = '' # 'http://supybot.com/Members/yourname/NetHack/download'
 
 import config
+import xlog
+reload(xlog)
+import announce
+reload(announce)
+import history
+reload(history)
+import stats
+reload(stats)
+import tailer
+reload(tailer)
+import tracker
+reload(tracker)
 import plugin
 reload(plugin) # In case we're being reloaded.
 # Add more reloads here if you add third-party modules and want them to be
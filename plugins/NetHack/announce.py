@@ -0,0 +1,224 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Getting announcements out to the channel without flooding it.
+
+Events from the same player that can be merged (several uniques slain, a
+string of achievements) are held for a few seconds and sent as one line, and
+lines go out no faster than a set rate.  If they pile up anyway, the
+unimportant ones are dropped and the rest summarized.
+"""
+
+from collections import deque
+import threading
+import time
+
+# Priorities; low-priority events are the first to go under backlog
+LOW = 0
+NORMAL = 1
+
+
+def english_list(items):
+    """['a', 'b', 'c'] -> 'a, b and c'"""
+    if len(items) == 1:
+        return items[0]
+    return "%s and %s" % (', '.join(items[:-1]), items[-1])
+
+
+class Event(object):
+    """Something worth announcing.
+
+    If `merged_template` is given, more events of the same `kind` from the
+    same player shortly after are folded into this one, and the lot is
+    announced as `merged_template` filled in with `player` and `items`.
+    """
+    __slots__ = ('player', 'kind', 'text', 'item', 'merged_template',
+                 'priority')
+
+    def __init__(self, player, kind, text, item=None, merged_template=None,
+                 priority=NORMAL):
+        self.player = player
+        self.kind = kind
+        self.text = text
+        self.item = item
+        self.merged_template = merged_template
+        self.priority = priority
+
+
+class Line(object):
+    """A line ready to be sent, and how many events (and games ended) it
+    speaks for, so summaries can add them up.
+    """
+    __slots__ = ('text', 'priority', 'events', 'deaths')
+
+    def __init__(self, text, priority=NORMAL, events=1, deaths=0):
+        self.text = text
+        self.priority = priority
+        self.events = events
+        self.deaths = deaths
+
+
+class AnnouncementQueue(object):
+    """Coalesces events and sends them with `send`, within a budget.
+
+    add() and flush() may be called from any thread; `send` is called
+    outside the lock.  `clock` is only there for the benefit of tests.
+    """
+    def __init__(self, send, window=10.0, rate=0.5, max_backlog=5,
+                 clock=time.time):
+        self.send = send
+        self.window = window
+        self.rate = rate
+        self.max_backlog = max_backlog
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        # [due, key, events]; groups waiting for their window to close
+        self.groups = []
+        # Lines waiting for the budget
+        self.lines = deque()
+        self.dropped = 0
+
+        # Token bucket: one token per line sent, refilled at `rate` a second
+        self.tokens = self.burst
+        self.last_refill = clock()
+
+    @property
+    def burst(self):
+        return max(1.0, self.rate)
+
+    def __len__(self):
+        return len(self.groups) + len(self.lines)
+
+    def next_due(self):
+        """Returns the earliest time a flush() could send anything, or None
+        if nothing's waiting (or the rate is zero and the budget spent).
+        """
+        with self.lock:
+            if not self.groups and not self.lines:
+                return None
+
+            if self.tokens >= 1:
+                refilled = self.last_refill
+            elif self.rate > 0:
+                refilled = self.last_refill + (1 - self.tokens) / self.rate
+            else:
+                return None
+
+            if self.lines:
+                return refilled
+            return max(refilled, min(group[0] for group in self.groups))
+
+    def add(self, events):
+        now = self.clock()
+        with self.lock:
+            for event in events:
+                if event.merged_template is None or self.window <= 0:
+                    self.groups.append([now, None, [event]])
+                    continue
+
+                key = event.player, event.kind
+                for group in self.groups:
+                    if group[1] == key:
+                        group[2].append(event)
+                        break
+                else:
+                    self.groups.append([now + self.window, key, [event]])
+
+    def flush(self):
+        """Sends whatever's due, as far as the budget allows.  Returns the
+        number of lines sent.
+        """
+        now = self.clock()
+        with self.lock:
+            waiting = []
+            for group in self.groups:
+                if group[0] <= now:
+                    self.lines.append(self._render(group[2]))
+                else:
+                    waiting.append(group)
+            self.groups = waiting
+            self._trim()
+
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            outgoing = []
+            while self.lines and self.tokens >= 1:
+                self.tokens -= 1
+                outgoing.append(self.lines.popleft().text)
+
+        for text in outgoing:
+            self.send(text)
+        return len(outgoing)
+
+    def _render(self, events):
+        first = events[0]
+        deaths = sum(1 for event in events if event.kind == 'death')
+        if len(events) == 1:
+            text = first.text
+        else:
+            text = first.merged_template.format(
+                player=first.player,
+                items=english_list([event.item for event in events]))
+        return Line(text, first.priority, len(events), deaths)
+
+    def _trim(self):
+        """Keeps the backlog down to max_backlog lines: the oldest
+        low-priority lines are dropped, then anything still over is rolled up
+        into a summary.
+        """
+        excess = len(self.lines) - self.max_backlog
+        if excess <= 0:
+            return
+
+        kept = deque()
+        for line in self.lines:
+            if excess > 0 and line.priority <= LOW:
+                excess -= 1
+                self.dropped += 1
+            else:
+                kept.append(line)
+        self.lines = kept
+        if excess <= 0:
+            return
+
+        # Leave room for the summary itself
+        skipped = [self.lines.pop() for _ in xrange(excess + 1)]
+        events = sum(line.events for line in skipped)
+        deaths = sum(line.deaths for line in skipped)
+        self.lines.append(Line(
+            "...and {0} more events ({1} games ended, {2} other "
+            "happenings).  Busy, busy.".format(events, deaths, events - deaths),
+            NORMAL, events, deaths))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,185 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Benchmarks the xlogfile parser against the one it replaced.
+
+Writes a synthetic xlogfile of however many lines you like (two million by
+default) to a temporary file, then times parsing every line and formatting
+the death announcement with report_template, as the plugin does.  Doesn't need
+supybot:
+
+    python bench.py [lines]
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import xlog
+
+roles = ['Arc', 'Bar', 'Cav', 'Hea', 'Kni', 'Mon', 'Pri', 'Ran', 'Rog',
+         'Sam', 'Tou', 'Val', 'Wiz']
+races = ['Hum', 'Elf', 'Dwa', 'Gno', 'Orc']
+deaths = ['killed by a jackal', 'killed by a soldier ant', 'ascended',
+          'petrified by a chickatrice corpse', 'quit', 'escaped',
+          'killed by the Wizard of Yendor, while helpless']
+
+# The fields the announcement needs, as opposed to everything in the line; the
+# two parsers have to agree on these
+announced_fields = ['name', 'role', 'race', 'gender_delta', 'align_delta',
+                    'death', 'level_desc', 'points', 'turns',
+                    'realtime_pretty', 'endtime']
+
+
+def synthetic_line(rng):
+    endtime = 1270000000 + rng.randint(0, 10 ** 8)
+    return ':'.join([
+        'version=3.4.3',
+        'points={0}'.format(rng.randint(0, 3000000)),
+        'deathdnum={0}'.format(rng.randint(0, 7)),
+        'deathlev={0}'.format(rng.randint(1, 50)),
+        'maxlvl={0}'.format(rng.randint(1, 50)),
+        'hp={0}'.format(rng.randint(-10, 300)),
+        'maxhp={0}'.format(rng.randint(10, 300)),
+        'deaths=1',
+        'deathdate=20100101',
+        'birthdate=20100101',
+        'uid=1000',
+        'role=' + rng.choice(roles),
+        'race=' + rng.choice(races),
+        'gender=' + rng.choice(['Mal', 'Fem']),
+        'align=' + rng.choice(['Law', 'Neu', 'Cha']),
+        'name=player{0}'.format(rng.randint(0, 500)),
+        'death=' + rng.choice(deaths),
+        'conduct=0x{0:x}'.format(rng.randint(0, 0xfff)),
+        'turns={0}'.format(rng.randint(1, 100000)),
+        'achieve=0x{0:x}'.format(rng.randint(0, 0xfff)),
+        'realtime={0}'.format(rng.randint(0, 500000)),
+        'starttime={0}'.format(endtime - rng.randint(0, 10 ** 6)),
+        'endtime={0}'.format(endtime),
+        'gender0=' + rng.choice(['Mal', 'Fem']),
+        'align0=' + rng.choice(['Law', 'Neu', 'Cha']),
+    ])
+
+
+def parse_xlog_original(line):
+    """The parser as it was, for comparison."""
+    line = line.strip()
+    data = {}
+    for keyval in line.split(':'):
+        key, val = keyval.split('=', 1)
+        data[key] = val
+
+    if data['gender0'] == data['gender']:
+        data['gender_delta'] = data['gender']
+    else:
+        data['gender_delta'] = "%(gender0)s->%(gender)s" % data
+
+    if data['align0'] == data['align']:
+        data['align_delta'] = data['align']
+    else:
+        data['align_delta'] = "%(align0)s->%(align)s" % data
+
+    data['level_desc'] = "%s dlvl %s" % (xlog.dungeons[int(data['deathdnum'])],
+                                         data['deathlev'])
+    if data['deathlev'] != data['maxlvl']:
+        data['level_desc'] += " (deepest dlvl: %(maxlvl)s)" % data
+
+    realtime = int(data['realtime'])
+    time_secs = realtime % 60;  realtime //= 60
+    time_mins = realtime % 60;  realtime //= 60
+    time_hrs  = realtime % 24;  realtime //= 24
+    time_days = realtime
+    if time_secs >= 30:
+        time_mins += 1
+    data['realtime_pretty'] = re.sub(
+        "^(0. )+",
+        "",
+        "%dd %dh %dm" % (time_days, time_hrs, time_mins)
+    )
+    return data
+
+
+def run(parse, path, announce_every):
+    """Parses every line in `path`, and formats the announcement for every
+    `announce_every`th game.  Returns elapsed seconds.
+    """
+    template = xlog.report_template
+    started = time.time()
+    with open(path) as f:
+        for i, line in enumerate(f):
+            record = parse(line)
+            if i % announce_every == 0:
+                template.format(**record)
+    return time.time() - started
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    rng = random.Random(0)
+
+    fd, path = tempfile.mkstemp(prefix='xlogfile-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for _ in xrange(line_count):
+                f.write(synthetic_line(rng))
+                f.write('\n')
+
+        # Check the two agree before bothering to time them
+        with open(path) as f:
+            for _, line in zip(xrange(1000), f):
+                old = parse_xlog_original(line)
+                new = xlog.parse_xlog(line)
+                for field in announced_fields:
+                    assert old[field] == new[field], (field, line)
+
+        # Replaying a backlog parses everything, but in normal use nearly
+        # every line is announced; try both ends
+        for announce_every, description in ((1, 'every game announced'),
+                                            (100, '1% announced')):
+            old = run(parse_xlog_original, path, announce_every)
+            new = run(xlog.parse_xlog, path, announce_every)
+            print "{0} lines, {1}:".format(line_count, description)
+            print "  original: {0:6.2f}s  {1:9.0f} lines/s".format(
+                old, line_count / old)
+            print "  new:      {0:6.2f}s  {1:9.0f} lines/s  ({2:.1f}x)".format(
+                new, line_count / new, old / new)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
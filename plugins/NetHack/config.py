@@ -41,9 +41,104 @@ def configure(advanced):
 
 
 NetHack = conf.registerPlugin('NetHack')
-# This is where your configuration variables (if any) should go.  For example:
-# conf.registerGlobalValue(NetHack, 'someConfigVariableName',
-#     registry.Boolean(False, """Help for someConfigVariableName."""))
+
+conf.registerGlobalValue(NetHack, 'messagesPerSecond',
+    registry.PositiveFloat(0.5, """Maximum rate at which to send
+    announcements to the channel.  Anything faster waits its turn."""))
+
+conf.registerGlobalValue(NetHack, 'maxBacklog',
+    registry.PositiveInteger(5, """Maximum number of announcements to keep
+    waiting to be sent.  Past that, unimportant ones (shoplifting and the
+    like) are dropped, then the rest are summarized in a single line."""))
+
+conf.registerGlobalValue(NetHack, 'coalesceWindow',
+    registry.Float(10.0, """Number of seconds to hold on to events that can
+    be merged, such as slaying uniques, in case the same player does more of
+    the same; they're then announced as one line.  0 disables merging."""))
+
+conf.registerGlobalValue(NetHack, 'catchupLimit',
+    registry.NonNegativeInteger(10, """When the bot starts up and finds more
+    than this many events were logged while it was gone, it announces a
+    single summary instead of all of them."""))
+
+conf.registerGlobalValue(NetHack, 'useInotify',
+    registry.Boolean(True, """Determines whether to watch the logs with
+    inotify, so events are announced as soon as they happen.  Needs the
+    pyinotify module; without it, the logs are polled instead."""))
+
+conf.registerGlobalValue(NetHack, 'minPollInterval',
+    registry.PositiveFloat(1.0, """Shortest time, in seconds, between checks
+    of the logs when polling.  Polling speeds up to this while things are
+    happening."""))
+
+conf.registerGlobalValue(NetHack, 'maxPollInterval',
+    registry.PositiveFloat(30.0, """Longest time, in seconds, between checks
+    of the logs.  Polling slows down to this while nothing's happening, and
+    stays here when inotify is doing the real work."""))
+
+conf.registerGlobalValue(NetHack, 'maxActiveGames',
+    registry.PositiveInteger(500, """Maximum number of games in progress to
+    keep track of, per source, for the who and watch commands.  Past that,
+    whoever's been quiet longest is forgotten."""))
+
+conf.registerGlobalValue(NetHack, 'activeGameTimeout',
+    registry.PositiveInteger(3600, """Number of seconds after which a game
+    nothing's been heard from is no longer shown as in progress.  Saved games
+    never show up in the xlogfile, so they'd otherwise hang around
+    forever."""))
+
+conf.registerGlobalValue(NetHack, 'sources',
+    registry.SpaceSeparatedSetOfStrings(['veekun'], """Names of the NetHack
+    servers to follow.  Each one is configured under
+    supybot.plugins.NetHack.sources.<name>; reload the plugin after adding
+    one."""))
+
+# Everything livelog_announcement() and the xlogfile can produce
+event_kinds = ['death', 'achieve', 'wish', 'bones', 'killed_uniq',
+               'shoplifted', 'other']
+
+# What the original server looked like, back when it was the only one
+source_defaults = {
+    'veekun': dict(
+        playground='/opt/nethack.veekun.com/nethack/var',
+        channels=['#cafe'],
+        urlTemplate='http://nethack.veekun.com/players/{name}/games/{endtime}',
+    ),
+}
+
+def registerSource(name):
+    """Registers the config group for a source, if it isn't already, and
+    returns it.
+    """
+    try:
+        return NetHack.sources.get(name)
+    except registry.NonExistentRegistryEntry:
+        pass
+
+    defaults = source_defaults.get(name, {})
+    source = conf.registerGroup(NetHack.sources, name)
+    conf.registerGlobalValue(source, 'playground',
+        registry.String(defaults.get('playground', ''), """Directory
+        containing this server's xlogfile and livelog."""))
+    conf.registerGlobalValue(source, 'channels',
+        registry.SpaceSeparatedSetOfStrings(defaults.get('channels', []),
+        """Channels to announce this server's games in."""))
+    conf.registerGlobalValue(source, 'urlTemplate',
+        registry.String(defaults.get('urlTemplate', ''), """Link to a finished
+        game, filled in with its xlogfile fields, e.g. {name} and {endtime}.
+        Only the fields the plugin keeps are available; any others come out
+        as ?.  Leave empty for no link."""))
+    conf.registerGlobalValue(source, 'players',
+        registry.SpaceSeparatedSetOfStrings([], """If not empty, only these
+        players' doings are announced.  Everyone's games still count for the
+        stats and history commands."""))
+    conf.registerGlobalValue(source, 'events',
+        registry.SpaceSeparatedSetOfStrings(event_kinds, """Kinds of events
+        to announce: any of %s.""" % ', '.join(event_kinds)))
+    return source
+
+for name in NetHack.sources():
+    registerSource(name)
 
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
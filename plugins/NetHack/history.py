@@ -0,0 +1,243 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""A local, indexed copy of every game in the xlogfile, so questions about
+past games don't mean grepping the whole thing.
+"""
+
+import re
+import sqlite3
+import threading
+
+from xlog import add_derived_fields
+
+# Columns that are stored as numbers; everything else is text
+integer_columns = frozenset(['deathdnum', 'deathlev', 'maxlvl', 'points',
+                             'turns', 'realtime', 'endtime'])
+columns = ['name', 'role', 'race', 'gender', 'gender0', 'align', 'align0',
+           'death', 'deathdnum', 'deathlev', 'maxlvl', 'points', 'turns',
+           'realtime', 'endtime']
+
+table_schema = """
+    CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        name TEXT NOT NULL COLLATE NOCASE,
+        role TEXT COLLATE NOCASE,
+        race TEXT,
+        gender TEXT,
+        gender0 TEXT,
+        align TEXT,
+        align0 TEXT,
+        death TEXT,
+        killer TEXT,
+        deathdnum INTEGER,
+        deathlev INTEGER,
+        maxlvl INTEGER,
+        points INTEGER,
+        turns INTEGER,
+        realtime INTEGER,
+        endtime INTEGER
+    );
+"""
+
+index_schema = """
+    CREATE UNIQUE INDEX IF NOT EXISTS games_source_name_endtime
+        ON games (source, name, endtime);
+    CREATE INDEX IF NOT EXISTS games_name_endtime ON games (name, endtime);
+    CREATE INDEX IF NOT EXISTS games_role_points ON games (role, points);
+    CREATE INDEX IF NOT EXISTS games_points ON games (points);
+    CREATE INDEX IF NOT EXISTS games_killer ON games (killer);
+    CREATE INDEX IF NOT EXISTS games_endtime ON games (endtime);
+"""
+
+killer_re = re.compile(r'^(?:[\w ]*? by )?(?:an? |the )?(.*?)(?:, while .*)?$')
+
+
+def killer_of(death):
+    """Boils a death reason down to whatever did it: "killed by a jackal,
+    while helpless" becomes "jackal".
+    """
+    return killer_re.match(death.strip().lower()).group(1)
+
+
+def as_record(row):
+    """Turns a stored game back into a record like parse_xlog()'s, so it can
+    be formatted with the same templates as a fresh one.
+    """
+    record = dict((column, unicode(row[column])) for column in columns
+                  if row[column] is not None)
+    add_derived_fields(record)
+    return record
+
+
+def _quote(value):
+    """Quotes a string for sqlite, for the rare spot where a parameter won't
+    do.
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _row_dict(cursor, row):
+    """Row factory that makes plain dicts.  sqlite3.Row won't take the
+    unicode keys str.format() looks fields up with.
+    """
+    return dict((column[0], value)
+                for column, value in zip(cursor.description, row))
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class GameHistory(object):
+    """Every finished game, in an sqlite database.
+
+    Safe to use from several threads; the tailer adds games from whichever
+    thread noticed them, and commands read from the main one.
+    """
+    def __init__(self, path, legacy_source):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = _row_dict
+        with self.lock:
+            self.db.executescript(table_schema)
+            self._migrate(legacy_source)
+            self.db.executescript(index_schema)
+
+    def _migrate(self, legacy_source):
+        """Databases from before there were several sources have no source
+        column; everything in them came from `legacy_source`.
+        """
+        columns = [row['name'] for row in
+                   self.db.execute('PRAGMA table_info(games)')]
+        if 'source' in columns:
+            return
+
+        with self.db:
+            self.db.execute('ALTER TABLE games ADD COLUMN source TEXT '
+                            'NOT NULL DEFAULT ' + _quote(legacy_source))
+            # This used to be unique, which it can't be now
+            self.db.execute('DROP INDEX IF EXISTS games_name_endtime')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def is_empty(self, source):
+        with self.lock:
+            return self.db.execute(
+                'SELECT 1 FROM games WHERE source = ? LIMIT 1',
+                (source,)).fetchone() is None
+
+    def add(self, source, records):
+        """Adds parsed xlog records from a source.  Games already stored are
+        skipped, so it's fine to add the same game twice.
+        """
+        rows = []
+        for record in records:
+            if record is None:
+                continue
+            row = [_to_int(record.get(column)) if column in integer_columns
+                   else record.get(column)
+                   for column in columns]
+            row.append(killer_of(record.get('death', '')))
+            row.append(source)
+            rows.append(row)
+
+        if not rows:
+            return
+
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO games ({0}, killer, source) '
+                    'VALUES ({1}?, ?)'.format(', '.join(columns),
+                                              '?, ' * len(columns)),
+                    rows)
+
+    def _query(self, sql, *params):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _select(self, sources, where, tail, *params):
+        """Returns the games from `sources` matching `where`."""
+        sql = 'SELECT * FROM games WHERE source IN ({0}) AND {1} {2}'.format(
+            ', '.join('?' * len(sources)), where, tail)
+        return self._query(sql, *(tuple(sources) + params))
+
+    def last(self, sources, name):
+        """Returns the most recent game by a player, or None."""
+        rows = self._select(sources, 'name = ?',
+                            'ORDER BY endtime DESC LIMIT 1', name)
+        return rows[0] if rows else None
+
+    def top(self, sources, role=None, limit=5):
+        """Returns the highest-scoring games, optionally for just one role."""
+        if role:
+            return self._select(sources, 'role = ?',
+                                'ORDER BY points DESC LIMIT ?', role, limit)
+        return self._select(sources, '1', 'ORDER BY points DESC LIMIT ?',
+                            limit)
+
+    def _count(self, sources, where, *params):
+        sql = 'SELECT COUNT(*) AS count FROM games ' \
+              'WHERE source IN ({0}) AND {1}'.format(
+                  ', '.join('?' * len(sources)), where)
+        return self._query(sql, *(tuple(sources) + params))[0]['count']
+
+    def deaths(self, sources, killer, limit=3):
+        """Returns how many games `killer` ended, and the most recent few.
+        Falls back to a substring match if nothing matches exactly.
+        """
+        killer = killer_of(killer)
+        where = 'killer = ?'
+        count = self._count(sources, where, killer)
+        if not count:
+            where = "killer LIKE '%' || ? || '%'"
+            count = self._count(sources, where, killer)
+
+        recent = self._select(sources, where, 'ORDER BY endtime DESC LIMIT ?',
+                              killer, limit)
+        return count, recent
+
+    def ascensions(self, sources, limit=5):
+        """Returns how many games were won, and the most recent few."""
+        where = "death = 'ascended'"
+        count = self._count(sources, where)
+        recent = self._select(sources, where, 'ORDER BY endtime DESC LIMIT ?',
+                              limit)
+        return count, recent
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
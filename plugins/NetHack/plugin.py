@@ -28,6 +28,7 @@
 
 ###
 
+import supybot.conf as conf
 import supybot.utils as utils
 from supybot.commands import *
 import supybot.plugins as plugins
@@ -37,90 +38,33 @@ import supybot.callbacks as callbacks
 import supybot.schedule as schedule
 
 from glob import glob
+import json
 import os
 import os.path
-import re
-
-# dnum, used in xlogfile
-dungeons = [
-    'the Dungeons of Doom',
-    'Gehennom',
-    'the Gnomish Mines',
-    'the Quest',
-    'Sokoban',
-    'Fort Ludios',
-    "Vlad's Tower",
-    'the Elemental Planes',
-]
-
-# achievements, used by livelog
-achievements = [
-    'completed the Quest and obtained the Bell of Opening',
-    'entered Gehennom',
-    'obtained the Candelabrum of Invocation',
-    'obtained the Book of the Dead',
-    'performed the Invocation',
-    'obtained the Amulet of Yendor',
-    'reached the Elemental Planes',
-    'reached the Astral Plane',
-    'ascended to a higher plane of existence',
-    "completed Mine's End",
-    'completed Sokoban',
-    'slew Medusa',
-]
-
-def parse_xlog(line):
-    line = line.strip()
-    data = {}
-    for keyval in line.split(':'):
-        key, val = keyval.split('=', 1)
-        data[key] = val
-
-    ### Extras for us
-    # Original and ending gender/alignment are tracked separately
-    if data['gender0'] == data['gender']:
-        data['gender_delta'] = data['gender']
-    else:
-        data['gender_delta'] = "%(gender0)s->%(gender)s" % data
-
-    if data['align0'] == data['align']:
-        data['align_delta'] = data['align']
-    else:
-        data['align_delta'] = "%(align0)s->%(align)s" % data
-
-    data['level_desc'] = "%s dlvl %s" % (dungeons[ int(data['deathdnum']) ],
-                                         data['deathlev'])
-    if data['deathlev'] != data['maxlvl']:
-        data['level_desc'] += " (deepest dlvl: %(maxlvl)s)" % data
-
-    # Human-readable time played
-    realtime = int(data['realtime'])
-    time_secs = realtime % 60;  realtime //= 60
-    time_mins = realtime % 60;  realtime //= 60
-    time_hrs  = realtime % 24;  realtime //= 24
-    time_days = realtime
-    # Don't need seconds
-    if time_secs >= 30:
-        time_mins += 1
-    # Construct '0d 0h 5m 12s', then lop off the 0x bits
-    data['realtime_pretty'] = re.sub(
-        "^(0. )+",
-        "",
-        "%dd %dh %dm" % (time_days, time_hrs, time_mins)
-    )
-    return data
-
-
-def parse_livelog(line):
-    line = line.strip()
-    data = {}
-    for keyval in line.split(':'):
-        key, val = keyval.split('=', 1)
-        data[key] = val
-
-    return data
+import threading
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    # No inotify; we'll just have to poll
+    pyinotify = None
+
+from announce import AnnouncementQueue, Event, LOW
+import config
+import history
+import stats
+from tailer import LogTailer
+from tracker import ActiveGames
+from xlog import achievements, fill_template, parse_livelog, parse_xlog, \
+    pretty_duration, read_xlog_batches, report_template
 
 def livelog_announcement(livelog):
+    """Returns an Event for a livelog entry, or None if it's not worth
+    announcing.
+    """
+    player = livelog['player']
+
     # achievement gained
     if 'achieve_diff' in livelog:
         # these are stored as 0xABC
@@ -129,46 +73,100 @@ def livelog_announcement(livelog):
         # each item in the achievement list is encoded as that number bit
         for i, achievement in enumerate(achievements):
             if achieve_diff & (1 << i):
-                return "{player} just {achievement}, on turn {turns}!".format(
-                           achievement=achievement, **livelog)
+                return Event(
+                    player, 'achieve',
+                    "{player} just {achievement}, on turn {turns}!".format(
+                        achievement=achievement, **livelog),
+                    item=achievement,
+                    merged_template="{player} just {items}!")
 
         # achieve_diff is zero?  nothing changed?  can't happen, but..
-        return "{0} just accomplished nothing!".format(player)
+        return Event(player, 'achieve',
+                     "{0} just accomplished nothing!".format(player),
+                     priority=LOW)
 
     # wishes
     if 'wish' in livelog:
-        return "%(player)s just wished for %(wish)s, on turn %(turns)s." % livelog
+        return Event(
+            player, 'wish',
+            "%(player)s just wished for %(wish)s, on turn %(turns)s." % livelog,
+            item=livelog['wish'],
+            merged_template="{player} just wished for {items}.")
 
     # kill a player ghost
     if 'bones_killed' in livelog:
-        return "%(player)s just killed the %(bones_monst)s of %(bones_killed)s, " \
-               "the former %(bones_rank)s, on turn %(turns)s on dlvl %(dlev)s." % livelog
+        return Event(
+            player, 'bones',
+            "%(player)s just killed the %(bones_monst)s of %(bones_killed)s, "
+            "the former %(bones_rank)s, on turn %(turns)s on dlvl %(dlev)s."
+            % livelog,
+            item=livelog['bones_killed'],
+            merged_template="{player} just laid the ghosts of {items} "
+                            "to rest.")
 
     # killed a unique monster
-    # may result in spam for the three horsemen..
+    # the three horsemen tend to come in a bunch, hence the merging
     if 'killed_uniq' in livelog:
         if livelog['killed_uniq'] == 'Medusa':
             # Medusa is already an achievement.  No need to announce twice
             return None
-        return "%(player)s has just slain %(killed_uniq)s on turn %(turns)s!" % livelog
+        return Event(
+            player, 'killed_uniq',
+            "%(player)s has just slain %(killed_uniq)s on turn %(turns)s!"
+            % livelog,
+            item=livelog['killed_uniq'],
+            merged_template="{player} has just slain {items}!")
 
     # stole something
     if 'shoplifted' in livelog:
-        return "%(player)s just stole %(shoplifted)s zorkmids' worth of merchandise " \
-               "from %(shopkeeper)s's %(shop)s, on turn %(turns)s.  Tut tut." % livelog
+        return Event(
+            player, 'shoplifted',
+            "%(player)s just stole %(shoplifted)s zorkmids' worth of "
+            "merchandise from %(shopkeeper)s's %(shop)s, on turn %(turns)s.  "
+            "Tut tut." % livelog,
+            item="%(shopkeeper)s's %(shop)s" % livelog,
+            merged_template="{player} just robbed {items}.  Tut tut.",
+            priority=LOW)
 
     # default??
-    return "%(player)s just did something-or-other." % livelog
-
-report_template = "{name} ({role} {race} {gender_delta} {align_delta}): " \
-                  "{death} on {level_desc}.  {points} points in {turns} turns, " \
-                  "wasting {realtime_pretty}.  " \
-                  "http://nethack.veekun.com/players/{name}/games/{endtime}"
+    return Event(player, 'other',
+                 "%(player)s just did something-or-other." % livelog,
+                 priority=LOW)
+
+class Source(object):
+    """One NetHack server being followed: its logs, where its news goes, and
+    its players' running totals.
+    """
+    def __init__(self, name, playground, announcer, offsets=None,
+                 aggregates=None):
+        self.name = name
+        self.playground = playground
+        offsets = offsets or {}
+        self.xlog = LogTailer(os.path.join(playground, 'xlogfile'),
+                              offsets.get('xlogfile'))
+        self.livelog = LogTailer(os.path.join(playground, 'livelog'),
+                                 offsets.get('livelog'))
+        self.announcer = announcer
+        self.active = ActiveGames()
+
+        # No saved stats means building them from the whole xlogfile first
+        self.backfilling_stats = aggregates is None
+        if aggregates is None:
+            aggregates = stats.PlayerAggregates()
+        self.aggregates = aggregates
+
+    @property
+    def tailers(self):
+        return self.xlog, self.livelog
+
+    def offsets(self):
+        """Everything needed to resume the tailers later."""
+        return dict(xlogfile=self.xlog.state(), livelog=self.livelog.state())
+
+
+# Before there could be several sources, everything came from this one
+LEGACY_SOURCE = 'veekun'
 
-CONFIG_PLAYGROUND = '/opt/nethack.veekun.com/nethack/var'
-CONFIG_USERDATA_FILE = '/opt/nethack.veekun.com/dgldir/userdata'
-CONFIG_USERDATA_WEB = 'http://nethack.veekun.com/userdata'
-CONFIG_CHANNEL = '#cafe'
 class NetHack(callbacks.Plugin):
     """Add the help for "@plugin help NetHack" here
     This should describe *how* to use this plugin."""
@@ -176,47 +174,562 @@ class NetHack(callbacks.Plugin):
         self.__parent = super(NetHack, self)
         self.__parent.__init__(irc)
 
-        self.xlog = open(os.path.join(CONFIG_PLAYGROUND, 'xlogfile'))
-        self.livelog = open(os.path.join(CONFIG_PLAYGROUND, 'livelog'))
-        self.xlog.seek(0, os.SEEK_END)
-        self.livelog.seek(0, os.SEEK_END)
+        # Pick up wherever we left off last time, if we can.  Anything saved
+        # for sources that aren't around right now is kept for later
+        self.offsets_path = conf.supybot.directories.data.dirize(
+            'nethack-offsets.json')
+        self.stats_path = conf.supybot.directories.data.dirize(
+            'nethack-stats.json')
+        self.saved_offsets = self._loadOffsets()
+        self.saved_stats = self._loadStats()
+
+        # inotify and the poller may both call _checkLogs at once, and the
+        # backfill has to finish up with neither of them running
+        self.check_lock = threading.Lock()
+        # Likewise for scheduling the next announcement flush
+        self.flush_lock = threading.Lock()
+
+        # Every game ever played, for the leaderboard commands
+        self.history = history.GameHistory(
+            conf.supybot.directories.data.dirize('nethack-history.sqlite'),
+            LEGACY_SOURCE)
+
+        self.sources = {}
+        for name in sorted(self.registryValue('sources')):
+            config.registerSource(name)
+            try:
+                source = Source(
+                    name, self._sourceValue(name, 'playground'),
+                    self._makeAnnouncer(irc, name),
+                    self.saved_offsets.get(name),
+                    self.saved_stats.pop(name, None),
+                )
+            except (IOError, OSError):
+                self.log.exception('Could not open the logs for NetHack '
+                                   'source %s; ignoring it.', name)
+                continue
+            self.sources[name] = source
+        self._configureSources()
+
+        # The first time round, read in the whole xlogfile; that can take a
+        # while, so do it in the background
+        backfills = [self.sources[name] for name in sorted(self.sources)
+                     if self.sources[name].backfilling_stats
+                     or self.history.is_empty(name)]
+        if backfills:
+            thread = threading.Thread(target=self._backfill, args=(backfills,),
+                                      name='nethack-backfill')
+            thread.daemon = True
+            thread.start()
 
         # Remove the event first, in case this is a reload.  This will fail if
         # this is the first load, so throw it in a try
         try:
-            schedule.removePeriodicEvent('nethack-log-ping')
+            schedule.removeEvent('nethack-log-ping')
+        except:
+            pass
+        try:
+            schedule.removeEvent('nethack-announce')
         except:
             pass
 
+        # Get woken up as soon as the logs change, if we can.  Polling still
+        # happens either way, but only as a safety net when inotify works.
+        # Either way, one poller and one notifier cover every source
+        self.notifier = None
+        if pyinotify is not None and self.registryValue('useInotify'):
+            try:
+                self._startNotifier()
+            except Exception:
+                self.log.exception('Could not watch the NetHack logs with '
+                                   'inotify; falling back to polling.')
+                self.notifier = None
+
+        self._schedulePoll(self.registryValue('minPollInterval'))
+
+    def die(self):
+        if self.notifier is not None:
+            self.notifier.stop()
+        for name in ('nethack-log-ping', 'nethack-announce'):
+            try:
+                schedule.removeEvent(name)
+            except:
+                pass
+        self.history.close()
+        self.__parent.die()
+
+    def _sourceValue(self, name, key):
+        return self.registryValue('sources.{0}.{1}'.format(name, key))
+
+    def _makeAnnouncer(self, irc, name):
+        def send(text):
+            for channel in self._sourceValue(name, 'channels'):
+                irc.queueMsg(ircmsgs.privmsg(channel, text))
+        return AnnouncementQueue(send)
+
+    def _configureSources(self):
+        for source in self.sources.itervalues():
+            source.announcer.window = self.registryValue('coalesceWindow')
+            source.announcer.rate = self.registryValue('messagesPerSecond')
+            source.announcer.max_backlog = self.registryValue('maxBacklog')
+            source.active.max_games = self.registryValue('maxActiveGames')
+            source.active.timeout = self.registryValue('activeGameTimeout')
+
+    def _flushAnnouncements(self):
+        # Pick up any config changes as we go
+        self._configureSources()
+        for source in self.sources.itervalues():
+            source.announcer.flush()
+        self._scheduleFlush()
+
+    def _scheduleFlush(self):
+        """Schedules the next _flushAnnouncements() for whenever the
+        soonest held-back announcement can go out.  Nothing is scheduled
+        while there's nothing waiting.
+        """
+        due = [source.announcer.next_due()
+               for source in self.sources.itervalues()]
+        due = [when for when in due if when is not None]
+        with self.flush_lock:
+            try:
+                schedule.removeEvent('nethack-announce')
+            except KeyError:
+                pass
+            if due:
+                schedule.addEvent(self._flushAnnouncements, min(due),
+                                  name='nethack-announce')
+
+    def _backfill(self, sources):
+        """Loads every game in each source's xlogfile into the history
+        database, and into the player stats if they need it.
+        """
+        for source in sources:
+            started = time.time()
+            game_count = 0
+            try:
+                with open(source.xlog.path) as f:
+                    game_count += self._backfillFrom(source, f)
+
+                    # Finish off with the tailer held off, so every game from
+                    # here on is counted by the tailer and nothing earlier is
+                    with self.check_lock:
+                        game_count += self._backfillFrom(source, f)
+                        if source.backfilling_stats:
+                            source.backfilling_stats = False
+                            self._saveStats()
+            except Exception:
+                # The stats are only partly built, so they stay unsaved and
+                # unused; the next load starts them over
+                self.log.exception('Could not load the game history for '
+                                   'NetHack source %s.', source.name)
+                continue
+            self.log.info('Loaded %s games from the %s xlogfile in %.1fs.',
+                          game_count, source.name, time.time() - started)
+
+    def _backfillFrom(self, source, f):
+        game_count = 0
+        for games in read_xlog_batches(f):
+            game_count += len(games)
+            # Games the tailer already added are just skipped
+            self.history.add(source.name, games)
+            if source.backfilling_stats:
+                source.aggregates.add(games)
+        return game_count
+
+    def _loadStats(self):
+        """Returns the PlayerAggregates saved by _saveStats(), by source."""
+        try:
+            with open(self.stats_path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+        # Back when there was only one source, this was just its players
+        if 'sources' not in data:
+            data = dict(sources={LEGACY_SOURCE: data})
+        return dict((name, stats.PlayerAggregates(players))
+                    for name, players in data['sources'].iteritems())
+
+    def _saveStats(self):
+        # Half-built stats aren't worth saving; they'll be rebuilt anyway
+        all_stats = dict(
+            (name, aggregates.to_json())
+            for name, aggregates in self.saved_stats.iteritems())
+        all_stats.update(
+            (name, source.aggregates.to_json())
+            for name, source in self.sources.iteritems()
+            if not source.backfilling_stats)
+
+        temp_path = self.stats_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(dict(sources=all_stats), f)
+        os.rename(temp_path, self.stats_path)
+
+    def _loadOffsets(self):
+        """Returns the tailer states saved by _saveOffsets(), by source, or an
+        empty dict if there aren't any.
+        """
+        try:
+            with open(self.offsets_path) as f:
+                offsets = json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+        # Back when there was only one source, this was just its offsets
+        if 'sources' not in offsets:
+            return {LEGACY_SOURCE: offsets}
+        return offsets['sources']
+
+    def _saveOffsets(self):
+        """Saves where the tailers are, so a restart doesn't lose anything."""
+        self.saved_offsets.update(
+            (name, source.offsets())
+            for name, source in self.sources.iteritems())
+        temp_path = self.offsets_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(dict(sources=self.saved_offsets), f)
+        os.rename(temp_path, self.offsets_path)
+
+    def _startNotifier(self):
+        """Starts a thread that checks a source's logs whenever inotify says
+        one of them was written to.
+        """
+        # (directory, filename) => sources
+        watched = {}
+        for source in self.sources.itervalues():
+            for tailer in source.tailers:
+                key = os.path.split(tailer.path)
+                watched.setdefault(key, []).append(source)
+
+        def on_event(event):
+            sources = watched.get((event.path, event.name))
+            if sources:
+                self._checkLogs(sources)
+
+        watch_manager = pyinotify.WatchManager()
+        for directory in set(directory for directory, _ in watched):
+            # Creation and moves are rotation
+            watch_manager.add_watch(
+                directory,
+                pyinotify.IN_MODIFY | pyinotify.IN_CREATE
+                    | pyinotify.IN_MOVED_TO,
+                proc_fun=on_event,
+            )
+        self.notifier = pyinotify.ThreadedNotifier(watch_manager)
+        self.notifier.daemon = True
+        self.notifier.start()
+
+    def _schedulePoll(self, interval):
+        """Checks the logs in `interval` seconds, then schedules the next
+        check.  The interval doubles while nothing's happening, and drops back
+        to the minimum as soon as something does.
+        """
         def callback():
-            self._checkLogs(irc)
-        schedule.addPeriodicEvent(callback, 10, name='nethack-log-ping')
-
-    def _checkLogs(self, irc):
+            next_interval = self.registryValue('maxPollInterval')
+            try:
+                if self._checkLogs() and self.notifier is None:
+                    next_interval = self.registryValue('minPollInterval')
+                elif self.notifier is None:
+                    next_interval = min(next_interval, interval * 2)
+            finally:
+                self._schedulePoll(next_interval)
+
+        schedule.addEvent(callback, time.time() + interval,
+                          name='nethack-log-ping')
+
+    def _checkLogs(self, sources=None):
         """Checks the files for new lines and, if there be any, prints them to
-        IRC.
+        IRC.  Checks every source, unless given a list of them.  Returns the
+        number of lines found.
 
         Actual work is all done here.
         """
+        with self.check_lock:
+            if sources is None:
+                sources = self.sources.values()
+
+            line_count = 0
+            new_games = 0
+            for source in sources:
+                source_lines, source_games = self._checkSourceLocked(source)
+                line_count += source_lines
+                new_games += source_games
+
+            # Stats go before offsets: if we die in between, the games are
+            # read again next time and recognized as already counted
+            if new_games:
+                self._saveStats()
+            if line_count:
+                self._saveOffsets()
+                # Anything that couldn't go out right away goes out later
+                self._scheduleFlush()
+
+            return line_count
+
+    def _checkSourceLocked(self, source):
+        """Reads and announces one source's new lines.  Returns the number of
+        lines read and the number of games newly counted in the stats.
+        """
+        events = []
+        line_count = 0
+        catching_up = source.xlog.catching_up or source.livelog.catching_up
+        source.xlog.catching_up = source.livelog.catching_up = False
 
         # Check xlogfile
-        self.xlog.seek(0, os.SEEK_CUR)
-        line = self.xlog.readline()
-        if line:
+        games = []
+        for line in source.xlog.read_lines():
+            line_count += 1
             data = parse_xlog(line)
-            report = report_template.format(**data)
-            msg = ircmsgs.privmsg(CONFIG_CHANNEL, report)
-            irc.queueMsg(msg)
+            if data is None:
+                self.log.warning('Bad xlogfile line: %r', line)
+                continue
+            # Counted even if it can't be announced
+            games.append(data)
+            try:
+                report = self._gameReport(source.name, data)
+            except (TypeError, KeyError, ValueError):
+                # One mangled line shouldn't stop everything else
+                self.log.warning('Bad xlogfile line: %r', line)
+                continue
+            events.append(Event(data['name'], 'death', report))
+
+        try:
+            self.history.add(source.name, games)
+        except Exception:
+            # Not worth missing the announcements over
+            self.log.exception('Could not add games to the NetHack history.')
+
+        new_games = 0
+        if not source.backfilling_stats:
+            new_games = source.aggregates.add(games)
 
         # Check livelog
-        self.livelog.seek(0, os.SEEK_CUR)
-        line = self.livelog.readline()
-        if line:
+        for line in source.livelog.read_lines():
+            line_count += 1
             data = parse_livelog(line)
-            report = livelog_announcement(data)
-            if report:
-                msg = ircmsgs.privmsg(CONFIG_CHANNEL, report)
-                irc.queueMsg(msg)
+            if data is not None:
+                source.active.update(data)
+            try:
+                event = livelog_announcement(data)
+            except (TypeError, KeyError, ValueError):
+                self.log.warning('Bad livelog line: %r', line)
+                continue
+            if event:
+                events.append(event)
+
+        # Only now are the games over: a death and the livelog lines leading
+        # up to it often turn up in the same check, and the game shouldn't
+        # come back to life
+        for game in games:
+            source.active.finish(game['name'])
+
+        # Everything above counts for stats and history; only what this
+        # source wants goes any further
+        events = self._filterEvents(source.name, events)
+        deaths = sum(1 for event in events if event.kind == 'death')
+
+        # If we were down for a while, there may be a pile of old news.
+        # Nobody wants all of it
+        if catching_up and len(events) > self.registryValue('catchupLimit'):
+            events = [Event(
+                None, 'summary',
+                "While I was away, {0} games ended and {1} other things "
+                "happened.".format(deaths, len(events) - deaths))]
+
+        # Anything that can go out right away, does; merging and pacing
+        # happen in there
+        if events:
+            source.announcer.add(events)
+            source.announcer.flush()
+
+        return line_count, new_games
+
+    def _filterEvents(self, name, events):
+        """Drops the events a source isn't interested in."""
+        players = set(player.lower()
+                      for player in self._sourceValue(name, 'players'))
+        kinds = self._sourceValue(name, 'events')
+        return [event for event in events
+                if event.kind in kinds
+                and (not players or event.player.lower() in players)]
+
+    def _gameReport(self, name, record):
+        """Describes a finished game, with a link if its source has one."""
+        report = report_template.format(**record)
+        if name in self.sources:
+            url_template = self._sourceValue(name, 'urlTemplate')
+            if url_template:
+                try:
+                    report += '  ' + fill_template(url_template, record)
+                except (IndexError, ValueError):
+                    self.log.warning('Bad urlTemplate for NetHack source '
+                                     '%s: %r', name, url_template)
+        return report
+
+    def _sourcesFor(self, msg):
+        """Names of the sources announced in the channel a message came from,
+        or of every source if there aren't any.
+        """
+        # (any() is supybot.commands' converter in here, not the builtin)
+        channel = ircutils.toLower(msg.args[0])
+        names = [name for name in sorted(self.sources)
+                 if channel in map(ircutils.toLower,
+                                   self._sourceValue(name, 'channels'))]
+        return names or sorted(self.sources)
+
+    ### Commands
+
+    def last(self, irc, msg, args, player):
+        """<player>
+
+        Shows how <player>'s most recent game ended.
+        """
+        row = self.history.last(self._sourcesFor(msg), player)
+        if row is None:
+            irc.reply("{0} hasn't finished a game yet.".format(player))
+            return
+        self._reply(irc, self._gameReport(row['source'],
+                                          history.as_record(row)))
+    last = wrap(last, ['something'])
+
+    def top(self, irc, msg, args, role):
+        """[<role>]
+
+        Shows the highest-scoring games, optionally only those played as
+        <role> (e.g. Val).
+        """
+        rows = self.history.top(self._sourcesFor(msg), role)
+        if not rows:
+            irc.reply("Nobody's played that yet.")
+            return
+        self._reply(irc, u'; '.join(
+            u'{0}. {1[name]} ({1[role]} {1[race]}, {1[death]}) '
+            u'{1[points]} points'.format(rank, row)
+            for rank, row in enumerate(rows, 1)))
+    top = wrap(top, [optional('something')])
+
+    def deaths(self, irc, msg, args, killer):
+        """<monster>
+
+        Shows how many games <monster> has ended, and whose.
+        """
+        count, rows = self.history.deaths(self._sourcesFor(msg), killer)
+        if not count:
+            irc.reply("{0} hasn't killed anyone.  Yet.".format(killer))
+            return
+        self._reply(irc, u'{0} games ended that way; most recently {1}.'.format(
+            count, u', '.join(u'{0[name]} ({0[role]}, {0[death]})'.format(row)
+                              for row in rows)))
+    deaths = wrap(deaths, ['text'])
+
+    def ascensions(self, irc, msg, args):
+        """takes no arguments
+
+        Shows how many games have been won, and the most recent winners.
+        """
+        count, rows = self.history.ascensions(self._sourcesFor(msg))
+        if not count:
+            irc.reply("Nobody has ascended.  Keep at it.")
+            return
+        self._reply(irc, u'{0} ascensions so far; most recently {1}.'.format(
+            count, u', '.join(u'{0[name]} ({0[role]} {0[race]}, '
+                              u'{0[points]} points)'.format(row)
+                              for row in rows)))
+    ascensions = wrap(ascensions)
+
+    def stats(self, irc, msg, args, player):
+        """<player>
+
+        Shows some totals for all of <player>'s finished games.
+        """
+        for name in self._sourcesFor(msg):
+            source = self.sources[name]
+            if source.backfilling_stats:
+                irc.reply("Still counting everyone's games; try again in a "
+                          "bit.")
+                return
+            player_stats = source.aggregates.get(player)
+            if player_stats is not None:
+                break
+        else:
+            irc.reply("{0} hasn't finished a game yet.".format(player))
+            return
+
+        role, role_share = player_stats.favorite(player_stats.roles)
+        race, race_share = player_stats.favorite(player_stats.races)
+        response = (
+            u"{player}: {s.games} games, {s.ascensions} ascensions "
+            u"({ratio:.1%}), best score {s.max_points} points, "
+            u"{realtime} played.  Mostly {role} ({role_share:.0%}) and "
+            u"{race} ({race_share:.0%})."
+        ).format(
+            player=player, s=player_stats,
+            ratio=float(player_stats.ascensions) / player_stats.games,
+            realtime=pretty_duration(player_stats.total_realtime),
+            role=role, role_share=role_share,
+            race=race, race_share=race_share,
+        )
+        if player_stats.best_streak > 1:
+            response += u"  Best streak: {0} ascensions in a row.".format(
+                player_stats.best_streak)
+        if player_stats.streak > 1:
+            response += u"  On a streak of {0} right now!".format(
+                player_stats.streak)
+        self._reply(irc, response)
+    stats = wrap(stats, ['something'])
+
+    def who(self, irc, msg, args):
+        """takes no arguments
+
+        Shows who's playing right now.
+        """
+        games = []
+        for name in self._sourcesFor(msg):
+            games.extend(self.sources[name].active.games())
+        if not games:
+            irc.reply("Nobody's playing.  Go start a game!")
+            return
+
+        games.sort(key=lambda game: game.last_seen, reverse=True)
+        now = time.time()
+        self._reply(irc, u'Playing now: ' + u', '.join(
+            u'{0} (T:{1}, {2} ago)'.format(
+                game.player, game.turns or '?',
+                pretty_duration(now - game.last_seen))
+            for game in games))
+    who = wrap(who)
+
+    def watch(self, irc, msg, args, player):
+        """<player>
+
+        Shows how <player>'s game in progress is going.
+        """
+        for name in self._sourcesFor(msg):
+            game = self.sources[name].active.get(player)
+            if game is not None:
+                break
+        else:
+            irc.reply("{0} isn't playing right now, as far as I know."
+                      .format(player))
+            return
+
+        response = u'{0} is on turn {1}'.format(game.player,
+                                                game.turns or '?')
+        if game.dlev:
+            response += u', on dlvl {0}'.format(game.dlev)
+        response += u'; last heard from {0} ago.'.format(
+            pretty_duration(time.time() - game.last_seen))
+        if game.best_achievement:
+            response += u'  Best so far: {0}.'.format(game.best_achievement)
+        self._reply(irc, response)
+    watch = wrap(watch, ['something'])
+
+    def _reply(self, irc, response):
+        """Wraps irc.reply() to do some Unicode decoding."""
+        if isinstance(response, str):
+            irc.reply(response)
+        else:
+            irc.reply(response.encode('utf8'))
 
 
 Class = NetHack
@@ -0,0 +1,278 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Replays an xlogfile and livelog through the whole plugin, as fast or as
+slowly as you like, and reports how it held up.
+
+Lines are written into a temporary playground by one thread while the plugin
+reads and announces them to a fake IRC connection; at the end you get lines
+per second handled, how long each announcement took to come out the other
+end after its line was written, and memory use.  Needs supybot, unlike
+bench.py.
+
+    python replay.py [--rate LINES_PER_SEC] [--lines N]
+    python replay.py --xlogfile PATH --livelog PATH
+
+Without log files, synthetic ones are made up.  By default the plugin's
+pacing is switched off so the pipeline itself is what's measured; pass
+--paced to keep it.
+"""
+
+from __future__ import division
+
+import argparse
+from collections import defaultdict, deque
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+import bench
+import xlog
+
+# Livelog events worth announcing, minus the player and turns
+livelog_events = [
+    'killed_uniq=Death',
+    'killed_uniq=Pestilence',
+    'killed_uniq=Famine',
+    'killed_uniq=Vlad the Impaler',
+    'wish=blessed +2 gray dragon scale mail',
+    'achieve=0x2:achieve_diff=0x2',
+    'achieve=0x400:achieve_diff=0x400',
+    'shoplifted=300:shopkeeper=Asidonhopo:shop=general store',
+]
+
+
+def synthetic_lines(rng, count):
+    """Yields (log, player, timestamp, line) for made-up games and events,
+    about one death for every four livelog lines.  Every line has a player
+    of its own, so announcements can be matched up with what caused them.
+    """
+    for i in xrange(count):
+        player = 'p{0}'.format(i)
+        if i % 5 == 0:
+            line = re.sub('name=[^:]*', 'name=' + player,
+                          bench.synthetic_line(rng))
+            yield 'xlogfile', player, i, line
+        else:
+            yield 'livelog', player, i, 'player={0}:turns={1}:{2}'.format(
+                player, rng.randint(1, 100000), rng.choice(livelog_events))
+
+
+def recorded_lines(xlogfile, livelog):
+    """Yields (log, player, timestamp, line) for the lines in real logs, in
+    the order they happened.
+    """
+    lines = []
+    for log, path, parse, player_field, time_field in (
+            ('xlogfile', xlogfile, xlog.parse_xlog, 'name', 'endtime'),
+            ('livelog', livelog, xlog.parse_livelog, 'player', 'curtime')):
+        if not path:
+            continue
+        with open(path) as f:
+            for line in f:
+                data = parse(line) or {}
+                try:
+                    timestamp = int(data.get(time_field, 0))
+                except ValueError:
+                    timestamp = 0
+                lines.append((log, data.get(player_field), timestamp,
+                              line.rstrip('\n')))
+
+    lines.sort(key=lambda entry: entry[2])
+    return lines
+
+
+class FakeIrc(object):
+    """Stands in for the bot's connection, and just notes what would have
+    been sent, and when.
+    """
+    def __init__(self):
+        self.sent = []
+
+    def queueMsg(self, msg):
+        self.sent.append((time.time(), msg.args[1]))
+
+
+def write_lines(playground, lines, rate, written):
+    """Appends `lines` to the logs in `playground`, `rate` a second, noting
+    (time, player) in `written` for each one.
+    """
+    files = dict((log, open(os.path.join(playground, log), 'a'))
+                 for log in ('xlogfile', 'livelog'))
+    started = time.time()
+    for i, (log, player, _, line) in enumerate(lines):
+        # Only sleep when well ahead; sleeping per line is too coarse
+        ahead = started + i / rate - time.time()
+        if ahead > 0.005:
+            time.sleep(ahead)
+
+        f = files[log]
+        f.write(line + '\n')
+        f.flush()
+        written.append((time.time(), player))
+
+    for f in files.values():
+        f.close()
+
+
+def make_plugin(playground, data_dir, paced, inotify):
+    """Sets up a NetHack plugin following just `playground`."""
+    import supybot.conf as conf
+    conf.supybot.directories.data.setValue(data_dir)
+
+    import config
+    config.NetHack.sources.setValue(['replay'])
+    source = config.registerSource('replay')
+    source.playground.setValue(playground)
+    source.channels.setValue(['#replay'])
+    source.urlTemplate.setValue('')
+    config.NetHack.useInotify.setValue(inotify)
+    if not paced:
+        config.NetHack.messagesPerSecond.setValue(10.0 ** 9)
+        config.NetHack.maxBacklog.setValue(10 ** 9)
+        config.NetHack.coalesceWindow.setValue(0.0)
+
+    import plugin
+    irc = FakeIrc()
+    return plugin.NetHack(irc), irc
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def max_rss_mb():
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='lines written per second (default 1000)')
+    parser.add_argument('--lines', type=int, default=20000,
+                        help='synthetic lines to write (default 20000)')
+    parser.add_argument('--xlogfile', help='replay this xlogfile')
+    parser.add_argument('--livelog', help='replay this livelog')
+    parser.add_argument('--poll', type=float, default=0.05,
+                        help='seconds between checks of the logs, when not '
+                             'using inotify (default 0.05)')
+    parser.add_argument('--paced', action='store_true',
+                        help="keep the plugin's announcement pacing, "
+                             'merging and backlog limits')
+    parser.add_argument('--inotify', action='store_true',
+                        help='let the plugin watch the logs with inotify')
+    args = parser.parse_args()
+
+    if args.xlogfile or args.livelog:
+        lines = recorded_lines(args.xlogfile, args.livelog)
+    else:
+        lines = list(synthetic_lines(random.Random(0), args.lines))
+
+    temp_dir = tempfile.mkdtemp(prefix='nethack-replay-')
+    try:
+        playground = os.path.join(temp_dir, 'playground')
+        data_dir = os.path.join(temp_dir, 'data')
+        os.mkdir(playground)
+        os.mkdir(data_dir)
+        for log in ('xlogfile', 'livelog'):
+            open(os.path.join(playground, log), 'w').close()
+
+        rss_before = max_rss_mb()
+        nethack, irc = make_plugin(playground, data_dir, args.paced,
+                                   args.inotify)
+
+        written = []
+        writer = threading.Thread(target=write_lines,
+                                  args=(playground, lines, args.rate, written))
+        started = time.time()
+        writer.start()
+
+        # Keep checking until everything's been written, read and sent
+        line_count = 0
+        finished = started
+        while True:
+            writing = writer.is_alive()
+            found = nethack._checkLogs()
+            nethack._flushAnnouncements()
+            if found:
+                line_count += found
+                finished = time.time()
+            queued = sum(len(source.announcer)
+                         for source in nethack.sources.values())
+            if not (writing or found or queued):
+                break
+            time.sleep(args.poll)
+        elapsed = finished - started
+
+        # Match announcements up with the lines that caused them, by player
+        written_at = defaultdict(deque)
+        for when, player in written:
+            written_at[player].append(when)
+        latencies = []
+        for when, text in irc.sent:
+            player = text.split(' ', 1)[0]
+            if written_at.get(player):
+                latencies.append(when - written_at[player].popleft())
+        latencies.sort()
+
+        source = nethack.sources['replay']
+        print "{0} lines written at up to {1:.0f}/s".format(
+            len(lines), args.rate)
+        print "  handled:       {0} lines in {1:.2f}s, {2:.0f} lines/s".format(
+            line_count, elapsed, line_count / elapsed if elapsed else 0)
+        print "  announced:     {0} messages ({1} matched to a line)".format(
+            len(irc.sent), len(latencies))
+        print "  latency:       p50 {0:.1f}ms  p95 {1:.1f}ms  p99 {2:.1f}ms  " \
+              "max {3:.1f}ms".format(*[
+                  percentile(latencies, fraction) * 1000
+                  for fraction in (0.50, 0.95, 0.99, 1.0)])
+        print "  memory:        max RSS {0:.1f}MB ({1:+.1f}MB since " \
+              "startup), {2} games tracked".format(
+                  max_rss_mb(), max_rss_mb() - rss_before,
+                  len(source.active))
+
+        nethack.die()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,157 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Running per-player totals, kept up to date as games end, so questions like
+"how many games has X played" never need to look at the xlogfile at all.
+"""
+
+import threading
+
+
+class PlayerStats(object):
+    """Everything we keep about one player's finished games."""
+    __slots__ = ('games', 'ascensions', 'max_points', 'total_points',
+                 'total_realtime', 'roles', 'races', 'streak', 'best_streak',
+                 'last_endtime')
+
+    def __init__(self, data=None):
+        self.games = 0
+        self.ascensions = 0
+        self.max_points = 0
+        self.total_points = 0
+        self.total_realtime = 0
+        self.roles = {}
+        self.races = {}
+        # Ascensions in a row
+        self.streak = 0
+        self.best_streak = 0
+        self.last_endtime = 0
+
+        if data:
+            for key in self.__slots__:
+                if key in data:
+                    setattr(self, key, data[key])
+
+    def to_json(self):
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+    def add(self, record):
+        """Counts a finished game.  Returns False and ignores it if it's not
+        newer than the last game counted, which makes re-reading a bit of the
+        xlogfile after a restart harmless.
+        """
+        try:
+            endtime = int(record.get('endtime', 0))
+            points = int(record.get('points', 0))
+            realtime = int(record.get('realtime', 0))
+        except ValueError:
+            return False
+        if endtime <= self.last_endtime:
+            return False
+        self.last_endtime = endtime
+
+        self.games += 1
+        self.max_points = max(self.max_points, points)
+        self.total_points += points
+        self.total_realtime += realtime
+
+        role = record.get('role', '?')
+        self.roles[role] = self.roles.get(role, 0) + 1
+        race = record.get('race', '?')
+        self.races[race] = self.races.get(race, 0) + 1
+
+        if record.get('death') == 'ascended':
+            self.ascensions += 1
+            self.streak += 1
+            self.best_streak = max(self.best_streak, self.streak)
+        else:
+            self.streak = 0
+
+        return True
+
+    @staticmethod
+    def favorite(histogram):
+        """Returns the most common key and its share of games, or (None, 0)."""
+        if not histogram:
+            return None, 0
+        key = max(histogram, key=histogram.get)
+        return key, float(histogram[key]) / sum(histogram.itervalues())
+
+
+class PlayerAggregates(object):
+    """PlayerStats for every player, by lowercased name.  Safe to share
+    between the tailer and command threads.
+    """
+    def __init__(self, data=None):
+        self.lock = threading.Lock()
+        self.players = {}
+        for name, player_data in (data or {}).iteritems():
+            self.players[name] = PlayerStats(player_data)
+
+    def __len__(self):
+        return len(self.players)
+
+    def add(self, records):
+        """Counts some parsed xlog records.  Returns how many were new."""
+        added = 0
+        with self.lock:
+            for record in records:
+                if record is None or 'name' not in record:
+                    continue
+                key = record['name'].lower()
+                player = self.players.get(key)
+                if player is None:
+                    player = self.players[key] = PlayerStats()
+                if player.add(record):
+                    added += 1
+        return added
+
+    def get(self, name):
+        """Returns a player's PlayerStats, or None if they've never finished
+        a game.
+        """
+        with self.lock:
+            player = self.players.get(name.lower())
+            if player is None:
+                return None
+
+            # Hand back a copy, so it can't change while it's being read
+            snapshot = PlayerStats(player.to_json())
+            snapshot.roles = dict(player.roles)
+            snapshot.races = dict(player.races)
+            return snapshot
+
+    def to_json(self):
+        with self.lock:
+            return dict((name, player.to_json())
+                        for name, player in self.players.iteritems())
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,117 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Following log files as they're written to."""
+
+import os
+
+
+class LogTailer(object):
+    """Follows a file that only ever gets appended to.  Each read returns
+    every complete line written since the last one; a half-written line at
+    the end is held on to until the rest shows up.
+
+    Copes with the file being rotated (replaced with a new one) or truncated,
+    and can pick up where a previous tailer left off, given its state().
+    """
+    def __init__(self, path, state=None):
+        self.path = path
+        self.file = None
+        self.partial = ''
+        # True when we resumed from a saved state, and so the next read may
+        # have a lot of catching up to do
+        self.catching_up = False
+        self._open()
+
+        if not state:
+            # First time; only what happens from now on is news
+            self.file.seek(0, os.SEEK_END)
+            return
+
+        # Anything written while we weren't looking needs catching up on.  If
+        # the file was rotated or truncated meanwhile, that's all of it
+        self.catching_up = True
+        size = os.fstat(self.file.fileno()).st_size
+        if state.get('inode') == self.inode \
+                and state.get('offset', 0) <= size:
+            self.file.seek(state['offset'])
+
+    def _open(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path)
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.partial = ''
+
+    @property
+    def offset(self):
+        """Position just after the last complete line read."""
+        return self.file.tell() - len(self.partial)
+
+    def state(self):
+        """Everything needed to resume from here later, as a dict."""
+        return dict(inode=self.inode, offset=self.offset)
+
+    def read_lines(self):
+        lines = self._read()
+
+        # If the file's been replaced, we've now read the last of the old one;
+        # switch to the new one and read it from the start
+        try:
+            rotated = os.stat(self.path).st_ino != self.inode
+        except OSError:
+            # Mid-rotation, probably; try again next time
+            rotated = False
+
+        if rotated:
+            self._open()
+            lines.extend(self._read())
+
+        return lines
+
+    def _read(self):
+        # Truncated?  Start over from the beginning
+        if os.fstat(self.file.fileno()).st_size < self.offset:
+            self.file.seek(0)
+            self.partial = ''
+
+        # Seeking to where we already are clears the EOF flag, so we'll see
+        # anything written since we last hit the end
+        self.file.seek(0, os.SEEK_CUR)
+        data = self.file.read()
+        if not data:
+            return []
+
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        return [line for line in lines if line.strip()]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -28,10 +28,550 @@
 
 ###
 
+import os
+import shutil
+import sqlite3
+from StringIO import StringIO
+import tempfile
+import time
+
 from supybot.test import *
+import supybot.schedule as schedule
+
+import announce
+import history
+import stats
+import tailer
+import tracker
+import xlog
+
+class TailerTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp(prefix='nethack-test-')
+        self.path = os.path.join(self.directory, 'xlogfile')
+        self.write('old\n', mode='w')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def write(self, data, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def rotate(self):
+        os.rename(self.path, self.path + '.1')
+        self.write('', mode='w')
+
+    def testFollow(self):
+        tail = tailer.LogTailer(self.path)
+        self.assertEqual(tail.read_lines(), [])
+        self.write('one\ntw')
+        self.assertEqual(tail.read_lines(), ['one'])
+        self.write('o\n\nthree\n')
+        self.assertEqual(tail.read_lines(), ['two', 'three'])
+        self.assertEqual(tail.read_lines(), [])
+        self.assertFalse(tail.catching_up)
+
+    def testResume(self):
+        tail = tailer.LogTailer(self.path)
+        self.write('one\ntw')
+        tail.read_lines()
+        state = tail.state()
+
+        self.write('o\n')
+        tail = tailer.LogTailer(self.path, state)
+        self.assert_(tail.catching_up)
+        self.assertEqual(tail.read_lines(), ['two'])
+
+    def testRotation(self):
+        tail = tailer.LogTailer(self.path)
+        self.write('one\n')
+        self.rotate()
+        self.write('two\n')
+        self.assertEqual(tail.read_lines(), ['one', 'two'])
+        self.write('three\n')
+        self.assertEqual(tail.read_lines(), ['three'])
+
+    def testResumeAfterRotation(self):
+        state = tailer.LogTailer(self.path).state()
+        self.write('one\n')
+        self.rotate()
+        self.write('two\nthree\n')
+
+        # The end of the old file is gone, but nothing in the new one is
+        tail = tailer.LogTailer(self.path, state)
+        self.assert_(tail.catching_up)
+        self.assertEqual(tail.read_lines(), ['two', 'three'])
+
+    def testTruncation(self):
+        tail = tailer.LogTailer(self.path)
+        self.write('one\ntwo\n')
+        tail.read_lines()
+        self.write('new\n', mode='w')
+        self.assertEqual(tail.read_lines(), ['new'])
+
+    def testResumeAfterTruncation(self):
+        tail = tailer.LogTailer(self.path)
+        self.write('one\ntwo\n')
+        tail.read_lines()
+        state = tail.state()
+
+        self.write('new\n', mode='w')
+        tail = tailer.LogTailer(self.path, state)
+        self.assertEqual(tail.read_lines(), ['new'])
+
+
+class XlogTestCase(SupyTestCase):
+    line = ('version=3.4.3:points=1234:deathdnum=2:deathlev=5:maxlvl=7:'
+            'role=Val:race=Dwa:gender=Fem:align=Law:name=Bob:'
+            'death=killed by a jackal, while helpless:turns=4321:'
+            'realtime=5430:endtime=1270000000:gender0=Mal:align0=Law\n')
+
+    def testParse(self):
+        record = xlog.parse_xlog(self.line)
+        self.assertEqual(record['name'], 'Bob')
+        self.assertEqual(record['death'], 'killed by a jackal, while helpless')
+        self.assertEqual(record['gender_delta'], 'Mal->Fem')
+        self.assertEqual(record['align_delta'], 'Law')
+        self.assertEqual(record['level_desc'],
+                         'the Gnomish Mines dlvl 5 (deepest dlvl: 7)')
+        self.assertEqual(record['realtime_pretty'], '1h 31m')
+        self.assertEqual(
+            xlog.report_template.format(**record),
+            'Bob (Val Dwa Mal->Fem Law): killed by a jackal, while helpless '
+            'on the Gnomish Mines dlvl 5 (deepest dlvl: 7).  1234 points in '
+            '4321 turns, wasting 1h 31m.')
+
+    def testFillTemplate(self):
+        record = xlog.parse_xlog(self.line)
+        self.assertEqual(xlog.fill_template('/{name}/{endtime}', record),
+                         '/Bob/1270000000')
+        # starttime is in the line, but nothing keeps it
+        self.assertEqual(xlog.fill_template('/{name}/{starttime}', record),
+                         '/Bob/?')
+
+    def testMalformed(self):
+        self.assertEqual(xlog.parse_xlog(''), None)
+        self.assertEqual(xlog.parse_xlog('garbage\n'), None)
+        self.assertEqual(xlog.parse_xlog('points=12:turns=3\n'), None)
+
+        # Anything missing or mangled comes out as a placeholder
+        record = xlog.parse_xlog('name=Bob:deathdnum=99:realtime=soon:'
+                                 'junk:deathlev=3\n')
+        self.assertEqual(record['name'], 'Bob')
+        self.assertEqual(record['gender_delta'], '?')
+        self.assertEqual(record['level_desc'],
+                         'somewhere dlvl 3 (deepest dlvl: ?)')
+        self.assertEqual(record['realtime_pretty'], 'who knows how long')
+
+    def testLivelog(self):
+        self.assertEqual(
+            xlog.parse_livelog('player=Bob:turns=10:wish=a blessed '
+                               '+2 gray dragon scale mail\n'),
+            dict(player='Bob', turns='10',
+                 wish='a blessed +2 gray dragon scale mail'))
+        self.assertEqual(xlog.parse_livelog('turns=10:wish=nothing\n'), None)
+        self.assertEqual(xlog.parse_livelog('::=:\n'), None)
+
+    def testBatches(self):
+        f = StringIO(self.line * 3 + self.line[:20])
+        batches = list(xlog.read_xlog_batches(f, batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        # The half-written line is left for next time
+        self.assertEqual(f.tell(), len(self.line) * 3)
+
+    def testPrettyDuration(self):
+        self.assertEqual(xlog.pretty_duration(29), '0m')
+        self.assertEqual(xlog.pretty_duration(90), '2m')
+        self.assertEqual(xlog.pretty_duration(86400 + 3600 + 60),
+                         '1d 1h 1m')
+
+
+class AnnounceTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.now = 1000.0
+        self.sent = []
+        self.queue = announce.AnnouncementQueue(
+            self.sent.append, window=10.0, rate=0.5, max_backlog=5,
+            clock=lambda: self.now)
+
+    def slay(self, player, monster):
+        return announce.Event(player, 'killed_uniq',
+                              '{0} slew {1}'.format(player, monster),
+                              item=monster,
+                              merged_template='{player} slew {items}')
+
+    def death(self, player):
+        return announce.Event(player, 'death', '{0} died'.format(player))
+
+    def testEnglishList(self):
+        self.assertEqual(announce.english_list(['a']), 'a')
+        self.assertEqual(announce.english_list(['a', 'b', 'c']),
+                         'a, b and c')
+
+    def testImmediate(self):
+        self.queue.add([self.death('Bob')])
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.sent, ['Bob died'])
+
+    def testMerge(self):
+        self.queue.add([self.slay('Bob', 'Death'), self.slay('Alice', 'War')])
+        self.now += 5
+        self.queue.add([self.slay('Bob', 'Famine')])
+        self.assertEqual(self.queue.flush(), 0)
+
+        self.now += 5
+        self.queue.rate = 10.0
+        self.queue.flush()
+        self.assertEqual(sorted(self.sent),
+                         ['Alice slew War', 'Bob slew Death and Famine'])
+        self.assertEqual(len(self.queue), 0)
+
+    def testNoWindow(self):
+        self.queue.window = 0
+        self.queue.rate = 10.0
+        self.queue.add([self.slay('Bob', 'Death'), self.slay('Bob', 'War')])
+        self.now += 1
+        self.assertEqual(self.queue.flush(), 2)
+
+    def testRate(self):
+        self.queue.add([self.death(player) for player in 'ABCD'])
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.queue.flush(), 0)
+        self.now += 1
+        self.assertEqual(self.queue.flush(), 0)
+        self.now += 1
+        self.assertEqual(self.queue.flush(), 1)
+        # Idle time doesn't build up more than a burst
+        self.now += 60
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.sent, ['A died', 'B died', 'C died'])
+
+    def testNextDue(self):
+        self.assertEqual(self.queue.next_due(), None)
+        # Held for the window
+        self.queue.add([self.slay('Bob', 'Orcus')])
+        self.assertEqual(self.queue.next_due(), 1010.0)
+        self.now = 1010.0
+        self.queue.flush()
+        self.assertEqual(self.queue.next_due(), None)
+
+        # Then held for the budget: a token every 2s
+        self.queue.add([self.death('Bob'), self.death('Alice')])
+        self.assertEqual(self.queue.next_due(), 1012.0)
+        self.now = 1012.0
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.queue.next_due(), 1014.0)
+
+    def testTrimDropsLowPriorityFirst(self):
+        lines = [announce.Line('death', deaths=1),
+                 announce.Line('shoplifted', announce.LOW),
+                 announce.Line('wish'),
+                 announce.Line('other', announce.LOW)]
+        self.queue.max_backlog = 2
+        self.queue.lines.extend(lines)
+        self.queue._trim()
+        self.assertEqual([line.text for line in self.queue.lines],
+                         ['death', 'wish'])
+        self.assertEqual(self.queue.dropped, 2)
+
+    def testTrimSummarizes(self):
+        self.queue.max_backlog = 3
+        self.queue.lines.extend(
+            [announce.Line('death', deaths=1) for _ in range(4)]
+            + [announce.Line('slew three', events=3)])
+        self.queue._trim()
+        self.assertEqual(len(self.queue.lines), 3)
+        self.assertEqual(
+            self.queue.lines[-1].text,
+            '...and 5 more events (2 games ended, 3 other happenings).  '
+            'Busy, busy.')
+
+
+def game(name='Bob', endtime=1000, death='killed by a jackal', **fields):
+    """A parsed xlogfile line, more or less."""
+    record = dict(name=name, role='Val', race='Dwa', death=death,
+                  points='100', turns='1000', realtime='600',
+                  endtime=str(endtime), deathdnum='0', deathlev='1',
+                  maxlvl='1')
+    record.update(fields)
+    xlog.add_derived_fields(record)
+    return record
+
+class StatsTestCase(SupyTestCase):
+    def testCounting(self):
+        aggregates = stats.PlayerAggregates()
+        self.assertEqual(aggregates.add([
+            game(endtime=1, points='50'),
+            game(endtime=2, death='ascended', points='3000', role='Wiz'),
+            game(endtime=3, death='ascended'),
+            game(endtime=4),
+            game(name='Alice', endtime=1),
+            None,
+        ]), 5)
+
+        bob = aggregates.get('BOB')
+        self.assertEqual(bob.games, 4)
+        self.assertEqual(bob.ascensions, 2)
+        self.assertEqual(bob.max_points, 3000)
+        self.assertEqual(bob.total_realtime, 2400)
+        self.assertEqual(bob.best_streak, 2)
+        self.assertEqual(bob.streak, 0)
+        self.assertEqual(bob.favorite(bob.roles), ('Val', 0.75))
+        self.assertEqual(aggregates.get('nobody'), None)
+
+    def testAlreadyCounted(self):
+        aggregates = stats.PlayerAggregates()
+        aggregates.add([game(endtime=1), game(endtime=2)])
+        # Re-reading the end of the xlogfile after a restart
+        self.assertEqual(aggregates.add([game(endtime=2), game(endtime=3)]),
+                         1)
+        self.assertEqual(aggregates.get('Bob').games, 3)
+
+    def testMalformed(self):
+        aggregates = stats.PlayerAggregates()
+        self.assertEqual(aggregates.add([game(points='lots'), {}]), 0)
+
+    def testJSON(self):
+        aggregates = stats.PlayerAggregates()
+        aggregates.add([game(endtime=1), game(endtime=2, death='ascended')])
+        loaded = stats.PlayerAggregates(aggregates.to_json())
+        self.assertEqual(loaded.get('bob').to_json(),
+                         aggregates.get('bob').to_json())
+        self.assertEqual(loaded.add([game(endtime=2)]), 0)
+
+
+class HistoryTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        fd, self.path = tempfile.mkstemp(prefix='nethack-history-')
+        os.close(fd)
+        self.history = history.GameHistory(self.path, 'veekun')
+
+    def tearDown(self):
+        self.history.close()
+        os.remove(self.path)
+        SupyTestCase.tearDown(self)
+
+    def testKillerOf(self):
+        self.assertEqual(history.killer_of('killed by a jackal'), 'jackal')
+        self.assertEqual(
+            history.killer_of('killed by the Wizard of Yendor, while '
+                              'helpless'),
+            'wizard of yendor')
+        self.assertEqual(history.killer_of('ascended'), 'ascended')
+
+    def testQueries(self):
+        self.assert_(self.history.is_empty('veekun'))
+        games = [
+            game(endtime=1, points='50'),
+            game(endtime=2, death='ascended', points='3000', role='Wiz'),
+            game(name='Alice', endtime=3, points='700'),
+        ]
+        self.history.add('veekun', games)
+        # Adding the same games again changes nothing
+        self.history.add('veekun', games)
+        self.history.add('other', [game(name='Carol', endtime=4)])
+        self.assertFalse(self.history.is_empty('veekun'))
+
+        last = self.history.last(['veekun'], 'bob')
+        self.assertEqual(last['death'], 'ascended')
+        self.assertEqual(self.history.last(['veekun'], 'carol'), None)
+
+        top = self.history.top(['veekun', 'other'])
+        self.assertEqual([row['name'] for row in top],
+                         ['Bob', 'Alice', 'Carol', 'Bob'])
+        self.assertEqual([row['points'] for row in
+                          self.history.top(['veekun'], 'wiz')], [3000])
+
+        count, rows = self.history.deaths(['veekun'], 'a jackal')
+        self.assertEqual(count, 2)
+        self.assertEqual([row['name'] for row in rows], ['Alice', 'Bob'])
+        # Substrings do, at a pinch
+        self.assertEqual(self.history.deaths(['veekun'], 'jack')[0], 2)
+
+        count, rows = self.history.ascensions(['veekun', 'other'])
+        self.assertEqual(count, 1)
+
+        # The commands look fields up with unicode keys
+        self.assertEqual(u'{0[name]} {0[points]}'.format(rows[0]),
+                         u'Bob 3000')
+        record = history.as_record(rows[0])
+        self.assertEqual(record['level_desc'],
+                         'the Dungeons of Doom dlvl 1')
+        xlog.report_template.format(**record)
+
+    def testMigration(self):
+        self.history.close()
+        os.remove(self.path)
+        db = sqlite3.connect(self.path)
+        # As it was before there could be several sources
+        db.execute(history.table_schema.replace(
+            'source TEXT NOT NULL,', ''))
+        db.execute('CREATE UNIQUE INDEX games_name_endtime '
+                   'ON games (name, endtime)')
+        db.execute("INSERT INTO games (name, death, killer, points, endtime) "
+                   "VALUES ('Bob', 'quit', 'quit', 10, 1)")
+        db.commit()
+        db.close()
+
+        self.history = history.GameHistory(self.path, 'veekun')
+        self.assertFalse(self.history.is_empty('veekun'))
+        # The same game can be on two servers now
+        self.history.add('other', [game(endtime=1)])
+        self.assertEqual(len(self.history.top(['veekun', 'other'])), 2)
+
+
+class TrackerTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.now = 1000.0
+        self.active = tracker.ActiveGames(max_games=2, timeout=60,
+                                          clock=lambda: self.now)
+
+    def testUpdate(self):
+        self.active.update(dict(player='Bob', turns='10', dlev='1'))
+        self.active.update(dict(player='bob', turns='20',
+                                achieve_diff='0x400'))
+        self.active.update(dict(player='bob', achieve_diff='junk'))
+        self.active.update(dict(turns='30'))
+
+        game = self.active.get('BOB')
+        self.assertEqual((game.player, game.turns, game.dlev),
+                         ('Bob', '20', '1'))
+        self.assertEqual(game.best_achievement, 'completed Sokoban')
+
+        self.active.finish('Bob')
+        self.assertEqual(self.active.get('bob'), None)
+
+    def testLimits(self):
+        for player in ('Alice', 'Bob', 'Carol'):
+            self.active.update(dict(player=player))
+            self.now += 40
+        # Alice was forgotten to make room; Bob has gone quiet
+        self.assertEqual(len(self.active), 2)
+        self.assertEqual([game.player for game in self.active.games()],
+                         ['Carol'])
+        self.assertEqual(self.active.get('bob'), None)
+
 
 class NetHackTestCase(PluginTestCase):
     plugins = ('NetHack',)
 
+    def setUp(self):
+        # An empty playground for the default source to follow
+        self.playground = tempfile.mkdtemp(prefix='nethack-playground-')
+        for filename in ('xlogfile', 'livelog'):
+            open(os.path.join(self.playground, filename), 'w').close()
+        conf.supybot.plugins.NetHack.sources.veekun.playground.setValue(
+            self.playground)
+        conf.supybot.plugins.NetHack.useInotify.setValue(False)
+        PluginTestCase.setUp(self)
+
+    def tearDown(self):
+        PluginTestCase.tearDown(self)
+        shutil.rmtree(self.playground)
+
+    def testDeathEndsGame(self):
+        # The last of a game's livelog and its death, read in one go
+        with open(os.path.join(self.playground, 'livelog'), 'a') as f:
+            f.write('player=Bob:turns=4000:dlev=5:achieve_diff=0x400\n')
+        with open(os.path.join(self.playground, 'xlogfile'), 'a') as f:
+            f.write('name=Bob:role=Val:race=Dwa:gender=Fem:align=Law:'
+                    'death=killed by a jackal:deathdnum=0:deathlev=5:'
+                    'maxlvl=5:points=100:turns=4001:realtime=60:'
+                    'endtime=1000:gender0=Fem:align0=Law\n')
+        self.irc.getCallback('NetHack')._checkLogs()
+        # The death is announced straight away
+        m = self.irc.takeMsg()
+        self.assertEqual(m.args[0], '#cafe')
+        self.failUnless(m.args[1].startswith('Bob (Val Dwa Fem Law): killed'))
+        self.assertRegexp('nethack who', "Nobody's playing")
+
+    def testFlushScheduled(self):
+        cb = self.irc.getCallback('NetHack')
+        with open(os.path.join(self.playground, 'xlogfile'), 'a') as f:
+            for name in ('Bob', 'Alice'):
+                f.write('name={0}:role=Val:race=Dwa:gender=Fem:align=Law:'
+                        'death=killed by a jackal:deathdnum=0:deathlev=5:'
+                        'maxlvl=5:points=100:turns=4001:realtime=60:'
+                        'endtime=1000:gender0=Fem:align0=Law\n'.format(name))
+        cb._checkLogs()
+        self.failUnless(self.irc.takeMsg().args[1].startswith('Bob'))
+        # Alice has to wait for the rate limit
+        self.failUnless('nethack-announce' in schedule.schedule.events)
+
+        # Once nothing's waiting, nothing's scheduled
+        cb.sources['veekun'].announcer.lines.clear()
+        cb._flushAnnouncements()
+        self.failIf('nethack-announce' in schedule.schedule.events)
+
+    def testUnknownUrlField(self):
+        url_template = conf.supybot.plugins.NetHack.sources.veekun.urlTemplate
+        original = url_template()
+        url_template.setValue('http://example.com/{name}/{uid}')
+        try:
+            with open(os.path.join(self.playground, 'xlogfile'), 'a') as f:
+                f.write('name=Bob:role=Val:race=Dwa:gender=Fem:align=Law:'
+                        'death=killed by a jackal:deathdnum=0:deathlev=5:'
+                        'maxlvl=5:points=100:turns=4001:realtime=60:'
+                        'endtime=1000:gender0=Fem:align0=Law:uid=5\n')
+            cb = self.irc.getCallback('NetHack')
+            cb._checkLogs()
+            m = self.irc.takeMsg()
+            self.failUnless(m.args[1].endswith('http://example.com/Bob/?'))
+            self.assertEqual(cb.history.last(['veekun'], 'Bob')['points'],
+                             100)
+        finally:
+            url_template.setValue(original)
+
+    def testFailedBackfill(self):
+        cb = self.irc.getCallback('NetHack')
+        source = cb.sources['veekun']
+        # Let the real backfill finish first
+        while source.backfilling_stats:
+            time.sleep(0.01)
+        if os.path.exists(cb.stats_path):
+            os.remove(cb.stats_path)
+
+        def fail(source, f):
+            source.aggregates.add([game()])
+            raise IOError('disk on fire')
+        source.backfilling_stats = True
+        cb._backfillFrom = fail
+        cb._backfill([source])
+        self.failUnless(source.backfilling_stats)
+
+        # New games mustn't get the half-built stats saved either
+        with open(os.path.join(self.playground, 'xlogfile'), 'a') as f:
+            f.write('name=Alice:role=Val:race=Dwa:gender=Fem:align=Law:'
+                    'death=killed by a jackal:deathdnum=0:deathlev=5:'
+                    'maxlvl=5:points=100:turns=4001:realtime=60:'
+                    'endtime=2000:gender0=Fem:align0=Law\n')
+        cb._checkLogs()
+        self.failIf(os.path.exists(cb.stats_path))
+
+    def testHistoryCommands(self):
+        self.irc.getCallback('NetHack').history.add('veekun', [
+            game(endtime=1, points='50'),
+            game(endtime=2, death='ascended', points='3000', role='Wiz'),
+            game(name='Alice', endtime=3, points='700'),
+        ])
+        self.assertRegexp('nethack last bob',
+                          r'Bob \(Wiz Dwa .*\): ascended')
+        self.assertRegexp('nethack last nobody', "hasn't finished a game")
+        self.assertRegexp('nethack top',
+                          r'1\. Bob \(Wiz Dwa, ascended\) 3000 points; '
+                          r'2\. Alice')
+        self.assertRegexp('nethack top Val', r'1\. Alice')
+        self.assertRegexp('nethack deaths a jackal',
+                          r'2 games ended that way; most recently Alice')
+        self.assertRegexp('nethack deaths a grid bug', "hasn't killed anyone")
+        self.assertRegexp('nethack ascensions',
+                          r'1 ascensions so far; most recently Bob')
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
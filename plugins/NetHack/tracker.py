@@ -0,0 +1,138 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Games in progress, as far as the livelog tells us about them."""
+
+from collections import OrderedDict
+import threading
+import time
+
+from xlog import achievements
+
+# achievements, by bit, from least to most impressive
+achievement_progress = [10, 9, 11, 0, 1, 2, 3, 4, 5, 6, 7, 8]
+
+
+class ActiveGame(object):
+    __slots__ = ('player', 'turns', 'dlev', 'achieve', 'last_seen')
+
+    def __init__(self, player):
+        self.player = player
+        self.turns = None
+        self.dlev = None
+        # Bitmask of everything achieved this game, as in the livelog
+        self.achieve = 0
+        self.last_seen = None
+
+    @property
+    def best_achievement(self):
+        """The most impressive thing done this game, or None."""
+        for bit in reversed(achievement_progress):
+            if self.achieve & (1 << bit):
+                return achievements[bit]
+        return None
+
+
+class ActiveGames(object):
+    """Who's playing right now.  Updated from every livelog line and cleared
+    when the game shows up in the xlogfile.
+
+    Games that are saved and never resumed don't show up in the xlogfile, so
+    this only remembers the `max_games` most recently heard from, and
+    games() leaves out anything quiet for longer than `timeout` seconds.
+    """
+    def __init__(self, max_games=500, timeout=3600, clock=time.time):
+        self.max_games = max_games
+        self.timeout = timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Lowercased player => ActiveGame, least recently heard from first
+        self.games_by_player = OrderedDict()
+
+    def __len__(self):
+        return len(self.games_by_player)
+
+    def update(self, livelog):
+        """Notes a parsed livelog line."""
+        player = livelog.get('player')
+        if not player:
+            return
+
+        key = player.lower()
+        with self.lock:
+            # Popping and re-adding moves it to the end
+            game = self.games_by_player.pop(key, None)
+            if game is None:
+                game = ActiveGame(player)
+            self.games_by_player[key] = game
+
+            if 'turns' in livelog:
+                game.turns = livelog['turns']
+            if 'dlev' in livelog:
+                game.dlev = livelog['dlev']
+            if 'achieve' in livelog:
+                try:
+                    game.achieve = int(livelog['achieve'], 16)
+                except ValueError:
+                    pass
+            elif 'achieve_diff' in livelog:
+                try:
+                    game.achieve |= int(livelog['achieve_diff'], 16)
+                except ValueError:
+                    pass
+            game.last_seen = self.clock()
+
+            while len(self.games_by_player) > self.max_games:
+                self.games_by_player.popitem(last=False)
+
+    def finish(self, player):
+        """Forgets a game that's over."""
+        with self.lock:
+            self.games_by_player.pop(player.lower(), None)
+
+    def get(self, player):
+        """Returns a player's game in progress, or None."""
+        with self.lock:
+            game = self.games_by_player.get(player.lower())
+        if game is None or self._stale(game):
+            return None
+        return game
+
+    def games(self):
+        """Returns the games in progress, most recently heard from first."""
+        with self.lock:
+            games = list(self.games_by_player.values())
+        return [game for game in reversed(games) if not self._stale(game)]
+
+    def _stale(self, game):
+        return self.clock() - game.last_seen > self.timeout
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
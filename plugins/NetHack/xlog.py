@@ -0,0 +1,217 @@
+###
+# Copyright (c) 2010, Alex "Eevee" Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Parsers for the xlogfile and livelog.
+
+Both are lines of key=value fields separated by colons.  Only the xlogfile
+fields we actually use are pulled out, and the fields the announcements derive
+from them (level_desc, realtime_pretty and friends) are added right away, so a
+record can go straight into report_template.format(**record).  Neither parser
+raises on a malformed line.
+"""
+
+import re
+import string
+
+# dnum, used in xlogfile
+dungeons = [
+    'the Dungeons of Doom',
+    'Gehennom',
+    'the Gnomish Mines',
+    'the Quest',
+    'Sokoban',
+    'Fort Ludios',
+    "Vlad's Tower",
+    'the Elemental Planes',
+]
+
+# achievements, used by livelog
+achievements = [
+    'completed the Quest and obtained the Bell of Opening',
+    'entered Gehennom',
+    'obtained the Candelabrum of Invocation',
+    'obtained the Book of the Dead',
+    'performed the Invocation',
+    'obtained the Amulet of Yendor',
+    'reached the Elemental Planes',
+    'reached the Astral Plane',
+    'ascended to a higher plane of existence',
+    "completed Mine's End",
+    'completed Sokoban',
+    'slew Medusa',
+]
+
+# The xlogfile fields anything actually uses; the rest are left in the line.
+# Add to this if a template needs more
+xlog_fields = [
+    'name', 'role', 'race', 'gender', 'gender0', 'align', 'align0',
+    'death', 'deathdnum', 'deathlev', 'maxlvl', 'points', 'turns',
+    'realtime', 'endtime',
+]
+
+
+def fields_re(fields=None):
+    """Builds a regex that pulls key=value pairs out of a line.  One
+    findall() with it is quicker than splitting the line up by hand.
+
+    Values may contain = but never :, and anything without a = is junk.  If
+    `fields` is given, only those keys are matched at all.
+    """
+    if fields is None:
+        key = '[^:=]+'
+    else:
+        # Longest first, so e.g. gender0 doesn't have to backtrack from gender
+        key = '|'.join(sorted(fields, key=len, reverse=True))
+    return re.compile('(?:^|:)(' + key + ')=([^:\r\n]*)')
+
+xlog_re = fields_re(xlog_fields)
+livelog_re = fields_re()
+
+
+def pretty_duration(seconds):
+    """Human-readable length of time, e.g. '3h 5m'."""
+    time_mins, time_secs = divmod(seconds, 60)
+    time_hrs, time_mins = divmod(time_mins, 60)
+    time_days, time_hrs = divmod(time_hrs, 24)
+    # Don't need seconds
+    if time_secs >= 30:
+        time_mins += 1
+
+    # Lop off the leading 0d and 0h bits
+    if time_days:
+        return "%dd %dh %dm" % (time_days, time_hrs, time_mins)
+    elif time_hrs:
+        return "%dh %dm" % (time_hrs, time_mins)
+    else:
+        return "%dm" % time_mins
+
+
+def add_derived_fields(data):
+    """Adds the fields the announcements use to an xlog record, in place.
+    Missing or mangled fields come out as placeholders.
+    """
+    get = data.get
+
+    # Original and ending gender/alignment are tracked separately
+    gender = get('gender', '?')
+    gender0 = get('gender0', '?')
+    if gender == gender0:
+        data['gender_delta'] = gender
+    else:
+        data['gender_delta'] = gender0 + '->' + gender
+
+    align = get('align', '?')
+    align0 = get('align0', '?')
+    if align == align0:
+        data['align_delta'] = align
+    else:
+        data['align_delta'] = align0 + '->' + align
+
+    try:
+        dungeon = dungeons[int(get('deathdnum'))]
+    except (TypeError, ValueError, IndexError):
+        dungeon = 'somewhere'
+    deathlev = get('deathlev', '?')
+    maxlvl = get('maxlvl', '?')
+    if deathlev == maxlvl:
+        data['level_desc'] = dungeon + ' dlvl ' + deathlev
+    else:
+        data['level_desc'] = "%s dlvl %s (deepest dlvl: %s)" % (
+            dungeon, deathlev, maxlvl)
+
+    try:
+        data['realtime_pretty'] = pretty_duration(int(get('realtime', 0)))
+    except ValueError:
+        data['realtime_pretty'] = 'who knows how long'
+
+
+# Each source adds its own link to the end
+report_template = "{name} ({role} {race} {gender_delta} {align_delta}): " \
+                  "{death} on {level_desc}.  {points} points in {turns} turns, " \
+                  "wasting {realtime_pretty}."
+
+
+class _Placeholders(dict):
+    def __missing__(self, key):
+        return '?'
+
+_formatter = string.Formatter()
+
+def fill_template(template, record):
+    """Fills a configurable template in from a record.  Fields the record
+    doesn't have, e.g. ones not in xlog_fields, come out as '?'.
+    """
+    return _formatter.vformat(template, (), _Placeholders(record))
+
+
+def parse_xlog(line):
+    """Parses an xlogfile line into a dict, derived fields and all, or
+    returns None if it's not a game at all.
+    """
+    data = dict(xlog_re.findall(line))
+    if 'name' not in data:
+        return None
+    add_derived_fields(data)
+    return data
+
+
+def read_xlog_batches(f, batch_size=5000):
+    """Reads an open xlogfile from wherever it is to the end, yielding lists
+    of records.  A half-written last line is left unread, so reading again
+    later picks it up whole.
+    """
+    batch = []
+    while True:
+        line = f.readline()
+        if not line.endswith('\n'):
+            f.seek(-len(line), 1)
+            break
+
+        record = parse_xlog(line)
+        if record is not None:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_livelog(line):
+    """Parses a livelog line into a dict, or returns None if it's not
+    anything a player did.
+    """
+    data = dict(livelog_re.findall(line))
+    if 'player' not in data:
+        return None
+    return data
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -51,6 +51,8 @@ __contributors__ = {}
 __url__ = 'http://git.veekun.com/?p=dywypi.git;a=summary'
 
 import config
+import snapshot
+reload(snapshot)
 import plugin
 reload(plugin) # In case we're being reloaded.
 # Add more reloads here if you add third-party modules and want them to be
@@ -47,4 +47,57 @@ conf.registerGlobalValue(Pokedex, 'databaseURL',
     registry.String('', """SQLAlchemy-compatible URL to the pokedex
     database."""))
 
+conf.registerGlobalValue(Pokedex, 'snapshotFile',
+    registry.String('', """Snapshot file written by '@pokedex export',
+    relative to the data directory.  If set, the plugin answers from it alone
+    and never touches the database; wildcard and fuzzy lookups aren't
+    available."""))
+
+conf.registerGlobalValue(Pokedex, 'replyCacheSize',
+    registry.NonNegativeInteger(500, """Number of rendered replies to keep
+    in memory, so popular lookups don't hit the database every time.  0
+    disables the cache."""))
+
+conf.registerGlobalValue(Pokedex, 'missCacheSize',
+    registry.NonNegativeInteger(1000, """Number of failed or ambiguous
+    queries to remember the reply to.  0 disables this cache."""))
+
+conf.registerGlobalValue(Pokedex, 'missCacheTTL',
+    registry.NonNegativeInteger(3600, """Number of seconds to remember the
+    reply to a failed or ambiguous query for."""))
+
+conf.registerGlobalValue(Pokedex, 'backgroundWarmup',
+    registry.Boolean(False, """Determines whether connecting to the database,
+    opening (or building) the lookup index, and priming the caches happen on
+    a separate thread, so loading the plugin doesn't block the bot.  Lookups
+    made before that's done are turned away."""))
+
+conf.registerGlobalValue(Pokedex, 'workerThreads',
+    registry.NonNegativeInteger(2, """Number of threads to run lookups on,
+    each with its own database connection, so a slow lookup doesn't hold up
+    the rest of the bot.  0 runs lookups on the main thread.  Takes effect
+    the next time the plugin connects to the database."""))
+
+conf.registerGlobalValue(Pokedex, 'maxQueuedLookups',
+    registry.PositiveInteger(20, """Number of lookups allowed to wait for a
+    free thread.  Anything past that is politely turned away.  Takes effect
+    the next time the plugin connects to the database."""))
+
+conf.registerGlobalValue(Pokedex, 'timingSamples',
+    registry.PositiveInteger(1000, """Number of recent lookups to keep
+    timings for, for '@pokedex stats'."""))
+
+conf.registerGlobalValue(Pokedex, 'slowQueryThreshold',
+    registry.Float(1.0, """Lookups taking longer than this many seconds, from
+    the command arriving to the last reply, are written to pokedex-slow.log
+    in the data directory.  0 disables the log."""))
+
+conf.registerGlobalValue(Pokedex, 'batchLimit',
+    registry.PositiveInteger(8, """Maximum number of comma- or
+    slash-separated things to look up with a single command."""))
+
+conf.registerGlobalValue(Pokedex, 'batchLineLength',
+    registry.PositiveInteger(400, """Maximum length, in bytes, of a line when
+    packing several replies together."""))
+
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -39,10 +39,57 @@ import supybot.callbacks as callbacks
 import pokedex.db
 import pokedex.db.tables as tables
 import pokedex.lookup
+import snapshot
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, subqueryload, subqueryload_all
 
+from array import array
+from collections import OrderedDict, deque
+import codecs
+import functools
+import Queue
+import re
+import threading
+import time
+import unicodedata
 import urllib
 
 
+# Everything each reply template touches, per table class.  Loading these up
+# front means a reply costs a fixed handful of queries, rather than one lazy
+# load per attribute.
+eager_loads = {
+    tables.Pokemon: [
+        joinedload('names_local'),
+        joinedload('default_form'),
+        subqueryload_all('species.names_local'),
+        subqueryload('stats'),
+        subqueryload_all('types.names_local'),
+        subqueryload_all('abilities.names_local'),
+    ],
+    tables.Move: [
+        joinedload('names_local'),
+        subqueryload_all('type.names_local'),
+        subqueryload_all('damage_class.names_local'),
+        subqueryload_all('move_effect.prose_local'),
+    ],
+    tables.Item: [
+        joinedload('names_local'),
+        joinedload('prose_local'),
+        subqueryload_all('pocket.names_local'),
+    ],
+    tables.Ability: [
+        joinedload('names_local'),
+        joinedload('prose_local'),
+    ],
+    tables.Nature: [
+        joinedload('names_local'),
+        subqueryload_all('increased_stat.names_local'),
+        subqueryload_all('decreased_stat.names_local'),
+    ],
+}
+
+
 def get_stat_color(stat):
     if stat < 41:
         return 4  # red
@@ -60,22 +107,689 @@ def get_stat_color(stat):
         return 13  # purple
 
 
+class ReplyCache(object):
+    """Tiny LRU cache of fully-rendered replies.  Objects' replies are keyed
+    by (table name, id); replies to queries that didn't find exactly one
+    thing are keyed by the normalized query.
+
+    With a `ttl`, entries are forgotten after that many seconds.  A size or
+    ttl of zero disables caching entirely.
+    """
+    def __init__(self, size, ttl=None, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, reply = self.entries.pop(key)
+            except KeyError:
+                return None
+
+            if expires is not None and expires < self.clock():
+                return None
+
+            # Re-insert to mark it as most recently used
+            self.entries[key] = expires, reply
+            return reply
+
+    def set(self, key, reply):
+        with self.lock:
+            self.entries.pop(key, None)
+            if self.size <= 0 or (self.ttl is not None and self.ttl <= 0):
+                return
+
+            expires = None
+            if self.ttl is not None:
+                expires = self.clock() + self.ttl
+            self.entries[key] = expires, reply
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+offensive_reply_factors = {
+    200: u'\x03092×\x0f',
+    50:  u'\x0304½×\x0f',
+    0:   u'\x03140×\x0f',
+}
+
+defensive_reply_factors = {
+    400: u'\x02\x03044×\x0f',
+    200: u'\x03042×\x0f',
+    50:  u'\x0309½×\x0f',
+    25:  u'\x02\x0309¼×\x0f',
+    0:   u'\x03110×\x0f',
+}
+
+
+class TypeChart(object):
+    """The whole type-effectiveness table, loaded once and flattened into an
+    array of damage factors (as percentages), so matchups never need to touch
+    the database.
+    """
+    def __init__(self, names, efficacies):
+        """`names` maps type ids to names, and `efficacies` is a list of
+        (damage type id, target type id, damage factor).
+        """
+        # Only types that actually take part in matchups; this skips ??? and
+        # Shadow
+        type_ids = sorted(set(row[0] for row in efficacies)
+                          | set(row[1] for row in efficacies))
+
+        self.indices = dict((type_id, i) for i, type_id in enumerate(type_ids))
+        self.names = [names[type_id] for type_id in type_ids]
+        self.indices_by_name = dict(
+            (name.lower(), i) for i, name in enumerate(self.names))
+
+        size = len(type_ids)
+        self.size = size
+        self.factors = array('B', [100]) * (size * size)
+        for damage_type_id, target_type_id, damage_factor in efficacies:
+            self.factors[self.indices[damage_type_id] * size
+                         + self.indices[target_type_id]] = damage_factor
+
+    @classmethod
+    def load(cls, session):
+        """Reads the chart out of the database."""
+        efficacies = session.query(
+            tables.TypeEfficacy.damage_type_id,
+            tables.TypeEfficacy.target_type_id,
+            tables.TypeEfficacy.damage_factor,
+        ).all()
+        types = session.query(tables.Type) \
+            .options(joinedload('names_local')) \
+            .all()
+        return cls(dict((type_.id, type_.name) for type_ in types),
+                   efficacies)
+
+    def __contains__(self, type_id):
+        return type_id in self.indices
+
+    def name(self, type_id):
+        return self.names[self.indices[type_id]]
+
+    def index_for_name(self, name):
+        """Returns the chart index for a type name, or None."""
+        return self.indices_by_name.get(name.strip().lower())
+
+    def offensive(self, type_id):
+        """Returns a dict of damage factor => names of types that `type_id`
+        hits for that factor.  Neutral matchups are left out.
+        """
+        row = self.indices[type_id] * self.size
+        modifiers = {}
+        for target in range(self.size):
+            factor = self.factors[row + target]
+            if factor != 100:
+                modifiers.setdefault(factor, []).append(self.names[target])
+        return modifiers
+
+    def defensive(self, indices):
+        """Returns a dict of damage factor => names of types that hit a
+        Pokémon with the given type indices for that factor.  Neutral
+        matchups are left out.
+        """
+        modifiers = {}
+        for attacker in range(self.size):
+            factor = 100
+            row = attacker * self.size
+            for index in indices:
+                factor = factor * self.factors[row + index] // 100
+            if factor != 100:
+                modifiers.setdefault(factor, []).append(self.names[attacker])
+        return modifiers
+
+
+def format_modifiers(modifiers, reply_factors, preposition):
+    """Turns a dict from TypeChart into e.g. "2× against Fire, Ice"."""
+    return '; '.join(
+        u'{factor} {preposition} {types}'.format(
+            factor=reply_factors[factor],
+            preposition=preposition,
+            types=', '.join(sorted(modifiers[factor])),
+        )
+        for factor in sorted(modifiers)
+    )
+
+
+def normalize_name(name):
+    """Folds case, accents and extra whitespace out of a name, so "Flabébé"
+    and " flabebe" come out the same.
+    """
+    name = unicodedata.normalize('NFKD', name.strip().lower())
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    return u' '.join(name.split())
+
+
+class NameIndex(object):
+    """Maps every name of every indexed thing, in every language, straight to
+    its table class and id.  Names shared by more than one thing (Metronome!)
+    aren't answered here, so the full lookup can ask which one was meant.
+    """
+    # Stands in for a name that means several things
+    AMBIGUOUS = object()
+
+    # Queries containing these need the full lookup's wildcard and prefix
+    # handling.  (A regex, because any() is supybot.commands' converter in
+    # here, not the builtin)
+    special_characters = u'*?:@'
+    special_re = re.compile(u'[' + re.escape(special_characters) + u']')
+
+    def __init__(self, session, table_classes):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        # Lookups run on several threads at once
+        self.lock = threading.Lock()
+
+        for cls in table_classes:
+            names_table = getattr(cls, 'names_table', None)
+            if names_table is None or not hasattr(names_table, 'name'):
+                continue
+
+            rows = session.query(names_table.foreign_id, names_table.name)
+            for foreign_id, name in rows:
+                if not name:
+                    continue
+
+                key = normalize_name(name)
+                target = cls, foreign_id
+                if self.entries.setdefault(key, target) != target:
+                    self.entries[key] = self.AMBIGUOUS
+
+    def get(self, query):
+        """Returns `(table class, id)` if `query` is exactly the name of one
+        thing, or None if the full lookup has to deal with it.
+        """
+        target = None
+        if not self.special_re.search(query):
+            target = self.entries.get(normalize_name(query))
+
+        if target is None or target is self.AMBIGUOUS:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return target
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def split_names(thing):
+    """Splits a query into the comma- or slash-separated things in it."""
+    names = [_.strip() for _ in re.split(u'[,/]', thing)]
+    return [_ for _ in names if _]
+
+
+def object_key(obj):
+    """Key for an object's reply in a snapshot."""
+    return u'obj:{0}:{1}'.format(obj.__tablename__, obj.id)
+
+
+def matchup_key(type_names):
+    """Key for a matchup reply in a snapshot.  Order doesn't matter."""
+    return u'matchup:' + u'/'.join(sorted(set(
+        _.strip().lower() for _ in type_names)))
+
+
+def result_kind(obj):
+    """Describes what a lookup found, for the slow query log: a table name, or
+    "no match".  Snapshot "objects" are reply keys.
+    """
+    if obj is None:
+        return u'no match'
+    elif isinstance(obj, basestring):
+        return obj.split(u':')[1]
+    return obj.__tablename__
+
+
+def pack_lines(pieces, limit, separator=u' | '):
+    """Packs a list of reply pieces into as few lines as possible, keeping
+    each line under `limit` bytes of UTF-8.  Pieces that are too long on their
+    own get a line to themselves.
+    """
+    lines = []
+    line = None
+    line_length = 0
+    separator_length = len(separator.encode('utf8'))
+    for piece in pieces:
+        piece_length = len(piece.encode('utf8'))
+        if line is not None and \
+                line_length + separator_length + piece_length <= limit:
+            line += separator + piece
+            line_length += separator_length + piece_length
+        else:
+            if line is not None:
+                lines.append(line)
+            line = piece
+            line_length = piece_length
+
+    if line is not None:
+        lines.append(line)
+    return lines
+
+
+class StatementCounter(object):
+    """Counts the SQL statements an engine sends, and the time spent on them,
+    so we can tell how much a reply really cost.
+    """
+    def __init__(self, engine):
+        self.reset()
+        self.started = None
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def reset(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def _before(self, *args, **kwargs):
+        self.count += 1
+        self.started = time.time()
+
+    def _after(self, *args, **kwargs):
+        if self.started is not None:
+            self.elapsed += time.time() - self.started
+            self.started = None
+
+
+class RollingTimings(object):
+    """Keeps the last few hundred timings for each phase of a reply, and
+    works out percentiles from them.
+    """
+    phases = ('lookup', 'sql', 'format', 'reply', 'total')
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.samples = dict((phase, deque(maxlen=size))
+                            for phase in self.phases)
+
+    def record(self, timings):
+        """Records a dict of phase => seconds."""
+        with self.lock:
+            for phase, samples in self.samples.items():
+                if phase in timings:
+                    samples.append(timings[phase])
+
+    def percentiles(self, phase, points=(50, 95, 99)):
+        """Returns the given percentiles for a phase, in seconds, or None if
+        there's nothing recorded yet.
+        """
+        with self.lock:
+            samples = sorted(self.samples[phase])
+        if not samples:
+            return None
+
+        # Nearest rank: the smallest sample at least point% of them are <=
+        return [samples[max(0, (len(samples) * point + 99) // 100 - 1)]
+                for point in points]
+
+    def __len__(self):
+        return len(self.samples['total'])
+
+
+class LookupContext(object):
+    """Everything a single thread needs to run lookups: its own database
+    session, a PokedexLookup using that session, and a statement counter.
+    """
+    def __init__(self, database_url):
+        self.db = pokedex.db.connect(database_url)
+        # This will rebuild the whole index if it doesn't exist yet
+        self.lookup = pokedex.lookup.PokedexLookup(
+            directory=conf.supybot.directories.data.dirize('pokedex-index'),
+            session=self.db,
+        )
+        self.statement_counter = StatementCounter(self.db.bind)
+
+
+class LookupPool(object):
+    """A fixed set of worker threads, each with its own LookupContext, that
+    run lookups off the main driver loop.
+
+    Results are handed to their callbacks in the order the jobs were
+    submitted, however the workers happen to finish.  `make_context` is
+    called once in each thread to get its context.
+    """
+    def __init__(self, size, max_queued, make_context, log):
+        # Unbounded, so stop() never has to wait for room; submit() keeps
+        # lookups to max_queued itself
+        self.queue = Queue.Queue()
+        self.max_queued = max_queued
+        self.log = log
+        self.lock = threading.Lock()
+        self.next_ticket = 0
+        self.next_delivery = 0
+        self.finished = {}
+        # Whether some thread is busy handing out results
+        self.delivering = False
+
+        self.threads = []
+        for i in range(size):
+            thread = threading.Thread(
+                target=self._work,
+                args=(make_context,),
+                name='Pokedex lookup #{0}'.format(i),
+            )
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, job, deliver):
+        """Queues `job`, which will be called with a LookupContext.  Its
+        return value is passed to `deliver`, or None if it blew up.
+
+        Returns False, and does nothing, if the queue is already full.
+        """
+        with self.lock:
+            if self.queue.qsize() >= self.max_queued:
+                return False
+
+            self.queue.put((self.next_ticket, job, deliver))
+            self.next_ticket += 1
+            return True
+
+    def stop(self):
+        """Tells the workers to exit once they've finished what's queued.
+        Doesn't wait for them.
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+
+    def _work(self, make_context):
+        try:
+            context = make_context()
+        except Exception:
+            # Keep taking jobs anyway, or everything after them would wait
+            # forever to be delivered
+            self.log.exception('Pokedex lookup thread failed to connect:')
+            context = None
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            ticket, job, deliver = item
+            result = None
+            if context is not None:
+                try:
+                    result = job(context)
+                except Exception:
+                    self.log.exception('Pokedex lookup failed:')
+                finally:
+                    # End the transaction, so we're not sitting on the
+                    # database
+                    context.db.rollback()
+
+            self._finish(ticket, deliver, result)
+
+    def _finish(self, ticket, deliver, result):
+        with self.lock:
+            self.finished[ticket] = deliver, result
+            if self.delivering:
+                # Whoever it is will get to this one too, in order
+                return
+            self.delivering = True
+
+        # Replying means network and disk; submit() shouldn't wait on that
+        while True:
+            with self.lock:
+                if self.next_delivery not in self.finished:
+                    self.delivering = False
+                    return
+                deliver, result = self.finished.pop(self.next_delivery)
+                self.next_delivery += 1
+            try:
+                deliver(result)
+            except Exception:
+                self.log.exception('Pokedex reply failed:')
+
+
 class Pokedex(callbacks.Plugin):
     """Add the help for "@plugin help Pokedex" here
     This should describe *how* to use this plugin."""
     def __init__(self, irc):
         self.__parent = super(Pokedex, self)
         self.__parent.__init__(irc)
-        self.db = pokedex.db.connect(self.registryValue('databaseURL'))
-        self.lookup = pokedex.lookup.PokedexLookup(
-            directory=conf.supybot.directories.data.dirize('pokedex-index'),
-            session=self.db,
-        )
+        self.reply_cache = ReplyCache(self.registryValue('replyCacheSize'))
+        # "I don't know what that is." and the suggestion lists cost a fuzzy
+        # search every time, and typos get asked over and over
+        self.miss_cache = ReplyCache(self.registryValue('missCacheSize'),
+                                     self.registryValue('missCacheTTL'))
+        self.warmup_generation = 0
+        self.timings = RollingTimings(self.registryValue('timingSamples'))
+        self.slow_log_lock = threading.Lock()
+        self.pool = None
+        self.context = None
+        self.snapshot = None
+        self._connect()
+
+    def die(self):
+        if self.pool is not None:
+            self.pool.stop()
+        self._swapSnapshot(None)
+        self.__parent.die()
+
+    def _connect(self):
+        """(Re)connects to the configured database and rebuilds anything
+        derived from it.
+
+        With backgroundWarmup on, the actual work happens on a separate
+        thread, and commands are turned away until it's done.
+        """
+        self.ready = False
+        self.database_url = self.registryValue('databaseURL')
+        self.snapshot_file = self.registryValue('snapshotFile')
+        self.warmup_generation += 1
+        self.warmup_step = 'starting'
+        self.warmup_started = time.time()
+        self.warmup_finished = None
+        self.warmup_error = None
+
+        if self.registryValue('backgroundWarmup'):
+            thread = threading.Thread(
+                target=self._backgroundWarmUp,
+                args=(self.warmup_generation, self.database_url,
+                      self.snapshot_file),
+                name='Pokedex warm-up',
+            )
+            thread.daemon = True
+            thread.start()
+        else:
+            self._warmUp(self.warmup_generation, self.database_url,
+                         self.snapshot_file)
+
+    def _backgroundWarmUp(self, *args):
+        """Thread target for _warmUp(); there's nobody to raise to here."""
+        try:
+            self._warmUp(*args)
+        except Exception:
+            self.log.exception('Pokedex warm-up failed:')
+
+    def _warmUp(self, generation, database_url, snapshot_file):
+        """Connects, opens (or builds) the lookup index, and loads the type
+        chart.  Nothing is swapped in until all of it has worked.
+
+        If there's a snapshot file, all of that is skipped, and it's opened
+        instead.
+        """
+        if snapshot_file:
+            self._openSnapshot(generation, snapshot_file)
+            return
+
+        try:
+            self.warmup_step = 'connecting and opening the lookup index'
+            context = LookupContext(database_url)
+            db = context.db
+            # Get Whoosh to actually open a searcher now, not on the first
+            # real query
+            context.lookup.lookup(u'pikachu')
+
+            self.warmup_step = 'building the name index'
+            name_index = NameIndex(db, context.lookup.indexed_tables.values())
+
+            self.warmup_step = 'loading the type chart'
+            type_chart = TypeChart.load(db)
+
+            # Don't hang onto this thread's connection
+            db.close()
+        except Exception as e:
+            if generation == self.warmup_generation:
+                self.warmup_error = e
+            raise
+
+        if generation != self.warmup_generation:
+            # The database URL changed while we were busy; a newer warm-up
+            # will take care of things
+            return
+
+        self.context = context
+        self._swapSnapshot(None)
+        self.name_index = name_index
+        self.type_chart = type_chart
+        self.reply_cache.clear()
+        self.miss_cache.clear()
+
+        self.warmup_step = 'priming the reply cache'
+        for type_id in type_chart.indices:
+            self.reply_cache.set(
+                (tables.Type.__tablename__, type_id),
+                self._render(db.query(tables.Type).get(type_id)),
+            )
+        db.close()
+
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+        if self.registryValue('workerThreads'):
+            self.warmup_step = 'starting lookup threads'
+            self.pool = LookupPool(
+                self.registryValue('workerThreads'),
+                self.registryValue('maxQueuedLookups'),
+                functools.partial(LookupContext, database_url),
+                self.log,
+            )
+
+        self.warmup_step = 'done'
+        self.warmup_finished = time.time()
+        self.ready = True
+
+    def _openSnapshot(self, generation, snapshot_file):
+        """Swaps in a snapshot written by the export command, and drops
+        everything that talks to the database.
+        """
+        try:
+            self.warmup_step = 'opening the snapshot'
+            snap = snapshot.Snapshot(
+                conf.supybot.directories.data.dirize(snapshot_file))
+        except Exception as e:
+            if generation == self.warmup_generation:
+                self.warmup_error = e
+            raise
+
+        if generation != self.warmup_generation:
+            return
+
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+        self.context = None
+        self.name_index = None
+        self.type_chart = None
+        self._swapSnapshot(snap)
+        self.reply_cache.clear()
+        self.miss_cache.clear()
+
+        self.warmup_step = 'done'
+        self.warmup_finished = time.time()
+        self.ready = True
+
+    def _swapSnapshot(self, snap):
+        """Starts serving from `snap`, or from nothing, and unmaps the
+        snapshot we were serving from before.
+        """
+        old, self.snapshot = self.snapshot, snap
+        if old is not None:
+            old.close()
+
+    def _checkDatabase(self):
+        """Reconnects if the database URL or snapshot file has been changed
+        since we last connected, so we don't keep serving replies from the
+        old one.
+        """
+        if self.registryValue('databaseURL') != self.database_url or \
+                self.registryValue('snapshotFile') != self.snapshot_file:
+            self._connect()
+
+        self.reply_cache.size = self.registryValue('replyCacheSize')
+        self.miss_cache.size = self.registryValue('missCacheSize')
+        self.miss_cache.ttl = self.registryValue('missCacheTTL')
+
+    def _checkReady(self, irc):
+        """Returns True if warm-up is done; otherwise tells the user to hold
+        on and returns False.
+        """
+        if self.ready:
+            return True
+
+        if self.warmup_error is not None:
+            self._reply(irc, "I couldn't load the Pokédex.  :(  "
+                             "Try '@pokedex status' for details.")
+        else:
+            self._reply(irc, "Still warming up the Pokédex ({0}); "
+                             "try again in a moment.".format(self.warmup_step))
+        return False
+
+    def status(self, irc, msg, args):
+        """takes no arguments
+
+        Reports whether the Pokédex has finished warming up, and how long it
+        took."""
+
+        self._checkDatabase()
+
+        if self.ready and self.snapshot is not None:
+            reply = "Ready; serving {0} entries from {1}.  " \
+                "Warm-up took {2:.1f}s." \
+                .format(len(self.snapshot), self.snapshot.path,
+                        self.warmup_finished - self.warmup_started)
+        elif self.ready:
+            reply = "Ready; warm-up took {0:.1f}s.  {1} replies cached.  " \
+                "Exact names: {2} known, {3} hits, {4} misses." \
+                .format(self.warmup_finished - self.warmup_started,
+                        len(self.reply_cache),
+                        len(self.name_index),
+                        self.name_index.hits,
+                        self.name_index.misses)
+        elif self.warmup_error is not None:
+            reply = "Warm-up failed while {0}: {1}".format(
+                self.warmup_step, self.warmup_error)
+        else:
+            reply = "Warming up ({0}); {1:.1f}s so far.".format(
+                self.warmup_step, time.time() - self.warmup_started)
+
+        self._reply(irc, reply)
+
+    status = wrap(status)
 
     def pokedex(self, irc, msg, args, thing):
         """<thing...>
 
-        Looks up <thing> in the veekun Pokédex."""
+        Looks up <thing> in the veekun Pokédex.  Separate several things with
+        commas or slashes to look them all up at once."""
 
         # Fix encoding.  Sigh.
         if not isinstance(thing, unicode):
@@ -85,13 +799,183 @@ class Pokedex(callbacks.Plugin):
             except UnicodeDecodeError:
                 thing = ascii_thing.decode('latin1')
 
+        self._checkDatabase()
+        if not self._checkReady(irc):
+            return
+
+        received = time.time()
+
+        def job(context):
+            timings = {}
+            context.statement_counter.reset()
+            try:
+                lines = self._pokedex(
+                    thing,
+                    functools.partial(self._resolve, context),
+                    functools.partial(self._render_many, context),
+                    timings,
+                )
+            finally:
+                self.log.debug('Pokedex: %r took %d SQL statement(s).',
+                               thing, context.statement_counter.count)
+
+            timings['sql'] = context.statement_counter.elapsed
+            timings['statements'] = context.statement_counter.count
+            return lines, timings
+
+        def deliver(result):
+            if result is None:
+                irc.error("Something went wrong looking that up.  :(")
+                return
+
+            lines, timings = result
+            started = time.time()
+            for line in lines:
+                self._reply(irc, line)
+            timings['reply'] = time.time() - started
+            timings['total'] = time.time() - received
+            self._recordTimings(thing, timings)
+
+        if self.snapshot is not None:
+            # No database here; everything's a quick probe of the snapshot
+            timings = {}
+            lines = self._pokedex(thing, self._snapshotResolve,
+                                  self._snapshotRenderMany, timings)
+            deliver((lines, timings))
+        elif self.pool is None:
+            deliver(job(self.context))
+        elif not self.pool.submit(job, deliver):
+            self._reply(irc, "I'm swamped right now; try again in a moment.")
+
+    pokedex = wrap(pokedex, [rest('something')])
+
+    def _pokedex(self, thing, resolve, render_many, timings):
+        """Does the actual work for the pokedex command.  Returns a list of
+        lines to reply with.
+
+        `resolve` turns a name into `(obj, None)` or `(None, reply)`, and
+        `render_many` turns a list of objects into a list of replies; see
+        _resolve() and _render_many().  How long each of those took, and what
+        was found, goes in the `timings` dict.
+        """
+        names = split_names(thing)
+        if len(names) <= 1:
+            started = time.time()
+            obj, reply = resolve(names[0] if names else thing)
+            timings['lookup'] = time.time() - started
+            timings['result'] = result_kind(obj)
+
+            started = time.time()
+            if obj is not None:
+                reply = render_many([obj])[0]
+            timings['format'] = time.time() - started
+            return [reply]
+
+        # Several things at once.  Resolve them all first, so everything that
+        # needs rendering can be loaded together
+        batch_limit = self.registryValue('batchLimit')
+        started = time.time()
+        resolved = [resolve(name) for name in names[:batch_limit]]
+        timings['lookup'] = time.time() - started
+        timings['result'] = u'batch of {0}'.format(len(resolved))
+
+        started = time.time()
+        rendered = iter(render_many(
+            [obj for obj, reply in resolved if obj is not None]))
+        timings['format'] = time.time() - started
+
+        pieces = []
+        for name, (obj, reply) in zip(names, resolved):
+            if obj is not None:
+                pieces.append(next(rendered))
+            else:
+                pieces.append(u"{0}: {1}".format(name, reply))
+
+        if len(names) > batch_limit:
+            pieces.append(u"(only looked up the first {0})".format(batch_limit))
+
+        return pack_lines(pieces, self.registryValue('batchLineLength'))
+
+    def _recordTimings(self, thing, timings):
+        """Adds a reply's timings to the histograms, and writes it to the
+        slow query log if it took long enough.
+        """
+        self.timings.record(timings)
+
+        threshold = self.registryValue('slowQueryThreshold')
+        if threshold <= 0 or timings['total'] < threshold:
+            return
+
+        line = u"{0}\t{1:.0f}ms\t{2}\t{3} statements\t{4}\n".format(
+            time.strftime('%Y-%m-%d %H:%M:%S'),
+            timings['total'] * 1000,
+            timings.get('result', u'?'),
+            timings.get('statements', 0),
+            thing,
+        )
+        path = conf.supybot.directories.data.dirize('pokedex-slow.log')
+        with self.slow_log_lock:
+            with codecs.open(path, 'a', encoding='utf8') as f:
+                f.write(line)
+
+    def stats(self, irc, msg, args):
+        """takes no arguments
+
+        Shows the 50th, 95th, and 99th percentile times for each phase of
+        recent lookups."""
+
+        phase_strings = []
+        for phase in RollingTimings.phases:
+            percentiles = self.timings.percentiles(phase)
+            if percentiles is None:
+                continue
+            phase_strings.append(u"{0} {1}".format(
+                phase, u'/'.join(u'{0:.1f}'.format(_ * 1000)
+                                 for _ in percentiles)))
+
+        if not phase_strings:
+            self._reply(irc, "Nothing's been looked up yet.")
+            return
+
+        self._reply(irc, u"p50/p95/p99 in ms over the last {0} lookups: "
+                         u"{1}.".format(len(self.timings),
+                                        u'; '.join(phase_strings)))
+
+    stats = wrap(stats, ['owner'])
+
+    def _resolve(self, context, thing):
+        """Looks up `thing`.
+
+        Returns `(obj, None)` for a single match, with Pokémon forms and
+        species already turned into Pokémon, or `(None, reply)` when there's
+        nothing or too much to show.
+        """
+        # Most of the time this is just someone's exact name for something,
+        # which doesn't need the full-text search at all
+        target = self.name_index.get(thing)
+        if target is not None:
+            cls, id = target
+            return self._fix_pokemon(context.db.query(cls).get(id)), None
+
+        # Typos and nonsense get asked over and over, too
+        miss_key = normalize_name(thing)
+        reply = self.miss_cache.get(miss_key)
+        if reply is not None:
+            return None, reply
+
+        obj, reply = self._search(context, thing)
+        if obj is None:
+            self.miss_cache.set(miss_key, reply)
+        return obj, reply
+
+    def _search(self, context, thing):
+        """The full-text part of _resolve(), without any caching."""
         # Similar logic to the site, here.
-        results = self.lookup.lookup(thing)
+        results = context.lookup.lookup(thing)
 
         # Nothing found
         if len(results) == 0:
-            self._reply(irc, "I don't know what that is.")
-            return
+            return None, u"I don't know what that is."
 
         # Multiple matches; propose them all
         if len(results) > 1:
@@ -123,19 +1007,217 @@ class Pokedex(callbacks.Plugin):
 
                 result_strings.append(result_string)
 
-            self._reply(irc, u"{0}: {1}?".format(reply, '; '.join(result_strings)))
-            return
+            return None, u"{0}: {1}?".format(reply, '; '.join(result_strings))
 
         # If we got here, there's an exact match; hurrah!
-        result = results[0]
-        obj = result.object
+        return self._fix_pokemon(results[0].object), None
 
-        # Deal with Pokémon shenanigans
+    def _snapshotResolve(self, thing):
+        """Like _resolve(), but using the snapshot.  The "objects" here are
+        just the keys of their replies.
+        """
+        if NameIndex.special_re.search(thing):
+            return None, u"I can't do fancy searches right now, sorry."
+
+        entry = self.snapshot.get(u'name:' + normalize_name(thing))
+        if entry is None:
+            return None, u"I don't know what that is."
+
+        # = points at an object's reply; > is a reply in itself, for names
+        # that mean several things
+        if entry.startswith(u'='):
+            return entry[1:], None
+        return None, entry[1:]
+
+    def _snapshotRenderMany(self, keys):
+        """Like _render_many(), but using the snapshot."""
+        return [self.snapshot.get(key)
+                or u"Uhh..  I found that, but I don't know what it is.  :("
+                for key in keys]
+
+    def _fix_pokemon(self, obj):
+        """Deals with Pokémon shenanigans: forms and species are rendered as
+        the Pokémon they belong to.
+        """
         if isinstance(obj, tables.PokemonForm):
-            obj = obj.pokemon
+            return obj.pokemon
         elif isinstance(obj, tables.PokemonSpecies):
-            obj = obj.default_pokemon
+            return obj.default_pokemon
+        return obj
+
+    def matchup(self, irc, msg, args, thing):
+        """<type>[/<type>]
+
+        Shows how hard each type hits a Pokémon of the given type or dual
+        type."""
+
+        if not isinstance(thing, unicode):
+            thing = thing.decode('utf8', 'replace')
+
+        self._checkDatabase()
+        if not self._checkReady(irc):
+            return
+
+        type_names = [_ for _ in re.split(u'[/\\s]+', thing.strip()) if _]
+        if len(set(_.lower() for _ in type_names)) > 2:
+            self._reply(irc, "Nothing has more than two types.")
+            return
+
+        if self.snapshot is not None:
+            reply = self.snapshot.get(matchup_key(type_names))
+            if reply is None:
+                reply = u"I don't know what type {0} is.".format(
+                    u'/'.join(type_names))
+            self._reply(irc, reply)
+            return
+
+        indices = []
+        for type_name in type_names:
+            index = self.type_chart.index_for_name(type_name)
+            if index is None:
+                self._reply(irc, u"I don't know what type {0} is.".format(
+                    type_name))
+                return
+            if index not in indices:
+                indices.append(index)
+
+        self._reply(irc, self._matchupReply(indices))
+
+    matchup = wrap(matchup, [rest('something')])
+
+    def _matchupReply(self, indices):
+        """Builds the reply for a matchup against the given type chart
+        indices.
+        """
+        modifiers = self.type_chart.defensive(indices)
+        return u"{0} takes {1}.".format(
+            '/'.join(self.type_chart.names[_].capitalize() for _ in indices),
+            format_modifiers(modifiers, defensive_reply_factors, 'from')
+                or u'neutral damage from everything',
+        )
+
+    def export(self, irc, msg, args, filename):
+        """[<filename>]
+
+        Writes every reply the Pokédex can give to a snapshot file in the data
+        directory (pokedex.snapshot by default), for use with
+        supybot.plugins.Pokedex.snapshotFile."""
+
+        self._checkDatabase()
+        if not self._checkReady(irc):
+            return
+
+        if self.snapshot is not None:
+            self._reply(irc, "I'm running from a snapshot myself; "
+                             "unset snapshotFile first.")
+            return
+
+        path = conf.supybot.directories.data.dirize(
+            filename or 'pokedex.snapshot')
+        database_url = self.database_url
+
+        def export():
+            try:
+                count = self._exportSnapshot(
+                    LookupContext(database_url), path)
+            except Exception:
+                self.log.exception('Pokedex export failed:')
+                irc.error("Export failed; check the log.")
+                return
+
+            self._reply(irc, "Wrote {0} entries to {1}.".format(count, path))
 
+        # This takes a while; don't hold up the bot
+        thread = threading.Thread(target=export, name='Pokedex export')
+        thread.daemon = True
+        thread.start()
+
+    export = wrap(export, ['owner', optional('something')])
+
+    def _exportSnapshot(self, context, path):
+        """Renders every object, name, and matchup, and writes them all to a
+        snapshot at `path`.  Returns the number of entries written.
+        """
+        records = {}
+
+        # Every object's reply
+        for cls in (tables.Pokemon, tables.Move, tables.Type, tables.Item,
+                    tables.Ability, tables.Nature):
+            ids = [id for (id,) in context.db.query(cls.id)]
+            # Stay under sqlite's limit on bound parameters
+            for start in range(0, len(ids), 500):
+                objs = context.db.query(cls) \
+                    .options(*eager_loads.get(cls, [])) \
+                    .filter(cls.id.in_(ids[start:start + 500]))
+                for obj in objs:
+                    records[object_key(obj)] = self._render(obj)
+            context.db.expunge_all()
+
+        # Every name, pointing at the above, or else the reply asking which
+        # thing was meant.  This goes around _resolve(), so the live caches
+        # and counters don't fill up with every name there is
+        for name, target in self.name_index.entries.iteritems():
+            if target is NameIndex.AMBIGUOUS:
+                obj, reply = self._search(context, name)
+            else:
+                cls, id = target
+                obj = self._fix_pokemon(context.db.query(cls).get(id))
+            if obj is not None:
+                records[u'name:' + name] = u'=' + object_key(obj)
+            else:
+                records[u'name:' + name] = u'>' + reply
+
+        # Every single and dual type matchup
+        type_count = len(self.type_chart.names)
+        for first in range(type_count):
+            for second in range(first, type_count):
+                indices = sorted(set([first, second]))
+                key = matchup_key(self.type_chart.names[_] for _ in indices)
+                records[key] = self._matchupReply(indices)
+
+        snapshot.write_snapshot(path, records)
+        context.db.close()
+        return len(records)
+
+    def _render_many(self, context, objs):
+        """Returns the replies for a list of objects, in the same order.
+
+        Anything not already in the reply cache is loaded with a single eager
+        query per table class and then rendered.
+        """
+        keys = [(obj.__tablename__, obj.id) for obj in objs]
+        replies = dict((key, self.reply_cache.get(key)) for key in keys)
+
+        missing = {}
+        for obj, key in zip(objs, keys):
+            if replies[key] is None:
+                missing.setdefault(type(obj), {})[obj.id] = obj
+
+        for cls, objs_by_id in missing.items():
+            for obj in self._eager_load(context, cls, objs_by_id):
+                key = obj.__tablename__, obj.id
+                replies[key] = self._render(obj)
+                self.reply_cache.set(key, replies[key])
+
+        return [replies[key] for key in keys]
+
+    def _eager_load(self, context, cls, objs_by_id):
+        """Reloads a batch of objects of the same class, along with
+        everything their reply template needs.
+        """
+        if cls not in eager_loads:
+            return objs_by_id.values()
+
+        return context.db.query(cls) \
+            .options(*eager_loads[cls]) \
+            .populate_existing() \
+            .filter(cls.id.in_(objs_by_id.keys())) \
+            .all()
+
+    def _render(self, obj):
+        """Builds the reply for a single Pokémon, move, type, item, ability,
+        or nature.
+        """
         if isinstance(obj, tables.Pokemon):
             reply_template = \
                 u"""#{id} {name}, {type}-type Pokémon.  Has {abilities}.  """ \
@@ -173,14 +1255,13 @@ class Pokedex(callbacks.Plugin):
             )
             stats = """{0} HP, {1}/{2} phys, {3}/{4} spec, {5} speed; {total} total""" \
                 .format(*colored_stats, total=colored_stat_total)
-            self._reply(irc, reply_template.format(
+            return reply_template.format(
                 id=obj.species.id,
                 name=obj.name,
                 type='/'.join(_.name for _ in obj.types),
                 abilities=' or '.join(_.name for _ in obj.abilities),
                 stats=stats,
                 link_name=link_name,
-                )
             )
 
         elif isinstance(obj, tables.Move):
@@ -189,7 +1270,7 @@ class Pokedex(callbacks.Plugin):
                 """{power} power; {accuracy}% accuracy; {pp} PP.  """ \
                 """{effect}  """ \
                 """http://veekun.com/dex/moves/{link_name}"""
-            self._reply(irc, reply_template.format(
+            return reply_template.format(
                 name=obj.name,
                 type=obj.type.name,
                 damage_class=obj.damage_class.name,
@@ -198,60 +1279,37 @@ class Pokedex(callbacks.Plugin):
                 pp=obj.pp,
                 effect=unicode(obj.short_effect.as_text()),
                 link_name=urllib.quote(obj.name.lower().encode('utf8')),
-                )
             )
 
         elif isinstance(obj, tables.Type):
             reply_template = u"""{name}, a type.  """
 
-            offensive_reply_factors = {
-                200: u'\x03092×\x0f',
-                50:  u'\x0304½×\x0f',
-                0:   u'\x03140×\x0f',
-            }
-
-            offensive_modifiers = {}
-            for matchup in obj.damage_efficacies:
-                if matchup.damage_factor != 100:
-                    offensive_modifiers.setdefault(matchup.damage_factor, []) \
-                        .append(matchup.target_type.name)
+            # Matchups come straight out of the type chart.  ??? and Shadow
+            # aren't in it, and don't have any
+            if obj.id in self.type_chart:
+                name = self.type_chart.name(obj.id)
+                offensive_modifiers = self.type_chart.offensive(obj.id)
+                defensive_modifiers = self.type_chart.defensive(
+                    [self.type_chart.indices[obj.id]])
+            else:
+                name = obj.name
+                offensive_modifiers = defensive_modifiers = {}
+
             if offensive_modifiers:
                 reply_template += u"""{offensive_modifiers}.  """
-                for factor in offensive_modifiers:
-                    offensive_modifiers[factor] = u'{factor} against {types}'.format(
-                        factor=offensive_reply_factors[factor],
-                        types=', '.join(sorted(offensive_modifiers[factor]))
-                    )
-
-            defensive_reply_factors = {
-                200: u'\x03042×\x0f',
-                50:  u'\x0309½×\x0f',
-                0:   u'\x03110×\x0f',
-            }
-
-            defensive_modifiers = {}
-            for matchup in obj.target_efficacies:
-                if matchup.damage_factor != 100:
-                    defensive_modifiers.setdefault(matchup.damage_factor, []) \
-                        .append(matchup.damage_type.name)
+
             if defensive_modifiers:
                 reply_template += u"""{defensive_modifiers}.  """
-                for factor in defensive_modifiers:
-                    defensive_modifiers[factor] = u'{factor} from {types}'.format(
-                        factor=defensive_reply_factors[factor],
-                        types=', '.join(sorted(defensive_modifiers[factor]))
-                    )
 
             reply_template += u"""http://veekun.com/dex/types/{link_name}"""
 
-            self._reply(irc, reply_template.format(
-                name=obj.name.capitalize(),
-                offensive_modifiers='; '.join(offensive_modifiers[_]
-                                              for _ in sorted(offensive_modifiers)),
-                defensive_modifiers='; '.join(defensive_modifiers[_]
-                                              for _ in sorted(defensive_modifiers)),
-                link_name=urllib.quote(obj.name.lower().encode('utf8')),
-                )
+            return reply_template.format(
+                name=name.capitalize(),
+                offensive_modifiers=format_modifiers(
+                    offensive_modifiers, offensive_reply_factors, 'against'),
+                defensive_modifiers=format_modifiers(
+                    defensive_modifiers, defensive_reply_factors, 'from'),
+                link_name=urllib.quote(name.lower().encode('utf8')),
             )
 
         elif isinstance(obj, tables.Item):
@@ -265,23 +1323,21 @@ class Pokedex(callbacks.Plugin):
             else:
                 effect = unicode(effect.as_text())
 
-            self._reply(irc, reply_template.format(
+            return reply_template.format(
                 name=obj.name,
                 effect=effect,
                 link_pocket=urllib.quote(obj.pocket.name.lower().encode('utf8')),
                 link_name=urllib.quote(obj.name.lower().encode('utf8')),
-                )
             )
 
         elif isinstance(obj, tables.Ability):
             reply_template = \
                 u"""{name}, an ability.  {effect}  """ \
                 """http://veekun.com/dex/abilities/{link_name}"""
-            self._reply(irc, reply_template.format(
+            return reply_template.format(
                 name=obj.name,
                 effect=obj.short_effect.as_text(),
                 link_name=urllib.quote(obj.name.lower().encode('utf8')),
-                )
             )
 
         elif isinstance(obj, tables.Nature):
@@ -289,19 +1345,16 @@ class Pokedex(callbacks.Plugin):
                 u"""{name}, a nature.  """ \
                 u"""Raises \x0303{up}\x0f, lowers \x0304{down}\x0f.  """ \
                 u"""http://veekun.com/dex/natures/{link_name}"""
-            self._reply(irc, reply_template.format(
+            return reply_template.format(
                 name=obj.name,
                 up=obj.increased_stat.name,
                 down=obj.decreased_stat.name,
                 link_name=urllib.quote(obj.name.lower().encode('utf8')),
-                )
             )
 
         else:
             # This can only happen if lookup.py is upgraded and we are not
-            self._reply(irc, "Uhh..  I found that, but I don't know what it is.  :(")
-
-    pokedex = wrap(pokedex, [rest('something')])
+            return u"Uhh..  I found that, but I don't know what it is.  :("
 
     def _reply(self, irc, response):
         """Wraps irc.reply() to do some Unicode decoding."""
@@ -0,0 +1,153 @@
+# encoding: utf8
+###
+# Copyright (c) 2010, Alex Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Compact, read-only snapshot of pre-rendered Pokédex replies.
+
+The file is a flat key/value store meant to be mmap()ed, so any number of bot
+processes can share it and nothing needs SQLAlchemy or sqlite to read it:
+
+    header      magic, number of entries, number of index slots, offset of
+                the index
+    data        key and value bytes, UTF-8, back to back
+    index       open-addressed hash table of fixed-size slots:
+                (hash, key offset, key length, value offset, value length)
+
+An empty slot has a key length of zero.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+
+# Bumped whenever the layout changes
+MAGIC = 'DYWYPID2'
+header = struct.Struct('<8sIII')
+slot = struct.Struct('<QIIII')
+
+
+def key_hash(key):
+    """Hashes a UTF-8 key.  This has to be the same in every process, so no
+    hash() here.
+    """
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+
+def write_snapshot(path, records):
+    """Writes a dict of unicode keys to unicode values to `path`.
+
+    The file is written under a temporary name and then renamed into place,
+    so anyone with the old one open isn't disturbed.
+    """
+    # Keep the table at most half full, so probes stay short
+    slot_count = 1
+    while slot_count < len(records) * 2:
+        slot_count *= 2
+    mask = slot_count - 1
+    slots = [None] * slot_count
+
+    data = []
+    offset = header.size
+    for key, value in records.iteritems():
+        key = key.encode('utf8')
+        value = value.encode('utf8')
+        key_offset = offset
+        value_offset = key_offset + len(key)
+        offset = value_offset + len(value)
+        data.append(key)
+        data.append(value)
+
+        hashed = key_hash(key)
+        i = hashed & mask
+        while slots[i] is not None:
+            i = (i + 1) & mask
+        slots[i] = hashed, key_offset, len(key), value_offset, len(value)
+
+    empty = slot.pack(0, 0, 0, 0, 0)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header.pack(MAGIC, len(records), slot_count, offset))
+        for chunk in data:
+            f.write(chunk)
+        for entry in slots:
+            if entry is None:
+                f.write(empty)
+            else:
+                f.write(slot.pack(*entry))
+    os.rename(temp_path, path)
+
+
+class Snapshot(object):
+    """A snapshot file, opened for reading."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, self.slot_count, self.index_offset = \
+            header.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError("{0} isn't a Pokédex snapshot, or was written "
+                             "by an older version; export it again"
+                             .format(path))
+
+        self.mask = self.slot_count - 1
+
+    def _slot(self, i):
+        return slot.unpack_from(self.map, self.index_offset + i * slot.size)
+
+    def get(self, key):
+        """Returns the unicode value for a unicode key, or None."""
+        key = key.encode('utf8')
+        hashed = key_hash(key)
+        i = hashed & self.mask
+        while True:
+            slot_hash, key_offset, key_length, value_offset, value_length = \
+                self._slot(i)
+            if not key_length:
+                return None
+
+            if slot_hash == hashed and \
+                    self.map[key_offset:key_offset + key_length] == key:
+                return self.map[value_offset:value_offset + value_length] \
+                    .decode('utf8')
+
+            i = (i + 1) & self.mask
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.map.close()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
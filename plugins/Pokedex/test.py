@@ -28,10 +28,320 @@
 
 ###
 
+import os
+import tempfile
+import threading
+
 from supybot.test import *
 
+import plugin
+import snapshot
+
+class ReplyCacheTestCase(SupyTestCase):
+    def testEviction(self):
+        cache = plugin.ReplyCache(2)
+        cache.set('a', u'A')
+        cache.set('b', u'B')
+        cache.get('a')
+        cache.set('c', u'C')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), u'A')
+        self.assertEqual(cache.get('c'), u'C')
+
+    def testDisabled(self):
+        cache = plugin.ReplyCache(0)
+        cache.set('a', u'A')
+        self.assertEqual(cache.get('a'), None)
+
+    def testTTL(self):
+        now = [1000.0]
+        cache = plugin.ReplyCache(10, ttl=60, clock=lambda: now[0])
+        cache.set('a', u'A')
+        now[0] += 59
+        self.assertEqual(cache.get('a'), u'A')
+        now[0] += 2
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+        cache.ttl = 0
+        cache.set('a', u'A')
+        self.assertEqual(cache.get('a'), None)
+
+
+class TypeChartTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        names = {1: u'normal', 8: u'ghost', 10: u'fire', 11: u'water',
+                 12: u'grass', 7: u'bug'}
+        self.chart = plugin.TypeChart(names, [
+            (1, 8, 0),
+            (10, 12, 200), (10, 7, 200),
+            (10, 10, 50), (10, 11, 50),
+            (12, 11, 200), (12, 10, 50),
+            (11, 10, 200),
+        ])
+
+    def index(self, name):
+        return self.chart.index_for_name(name)
+
+    def testOffensive(self):
+        self.assertEqual(self.chart.offensive(10),
+                         {200: [u'bug', u'grass'], 50: [u'fire', u'water']})
+
+    def testDualTypes(self):
+        # Both weak: 4x
+        self.assertEqual(
+            self.chart.defensive([self.index('grass'), self.index('bug')]),
+            {400: [u'fire']})
+        # Both resistant: 1/4x
+        self.assertEqual(
+            self.chart.defensive([self.index('Fire'), self.index('water')]),
+            {25: [u'fire'], 200: [u'water']})
+        # Immunity wins out over anything else
+        self.assertEqual(
+            self.chart.defensive([self.index('ghost'), self.index('grass')]),
+            {0: [u'normal'], 200: [u'fire']})
+
+    def testUnknownType(self):
+        self.assertEqual(self.index('shadow'), None)
+
+
+class FakeNames(object):
+    """Stands in for a names table; its columns just point back at it."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.foreign_id = self.name = self
+
+class FakeTable(object):
+    def __init__(self, *rows):
+        self.names_table = FakeNames(rows)
+
+class FakeSession(object):
+    def query(self, foreign_id, name):
+        return foreign_id.rows
+
+class NameIndexTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.pokemon = FakeTable((25, u'Pikachu'), (25, u'\u30d4\u30ab\u30c1\u30e5\u30a6'),
+                                 (669, u'Flab\xe9b\xe9'), (670, None))
+        self.moves = FakeTable((118, u'Metronome'), (1, u'Who?'))
+        self.items = FakeTable((277, u'Metronome'))
+        self.index = plugin.NameIndex(
+            FakeSession(), [self.pokemon, self.moves, self.items, object()])
+
+    def testExact(self):
+        self.assertEqual(self.index.get(u'Pikachu'), (self.pokemon, 25))
+        self.assertEqual(self.index.get(u'  \u30d4\u30ab\u30c1\u30e5\u30a6'), (self.pokemon, 25))
+        self.assertEqual(self.index.get(u'FLABEBE'), (self.pokemon, 669))
+        self.assertEqual(self.index.get(u'Raichu'), None)
+        self.assertEqual((self.index.hits, self.index.misses), (3, 1))
+        self.assertEqual(len(self.index), 5)
+
+    def testAmbiguous(self):
+        # Left to the full lookup, to ask which one
+        self.assertEqual(self.index.get(u'metronome'), None)
+        self.assertEqual(self.index.misses, 1)
+
+    def testSpecialCharacters(self):
+        self.assertEqual(self.index.get(u'Who?'), None)
+        self.assertEqual(self.index.get(u'pika*'), None)
+        self.assertEqual(self.index.get(u'@pikachu'), None)
+        self.assertEqual(self.index.hits, 0)
+
+
+class BatchTestCase(SupyTestCase):
+    def testSplitNames(self):
+        self.assertEqual(plugin.split_names(u'pikachu'), [u'pikachu'])
+        self.assertEqual(plugin.split_names(u' pikachu, surf /, tackle/ '),
+                         [u'pikachu', u'surf', u'tackle'])
+        self.assertEqual(plugin.split_names(u' , '), [])
+
+    def testPackLines(self):
+        self.assertEqual(plugin.pack_lines([u'aaa', u'bbb', u'ccc'], 9),
+                         [u'aaa | bbb', u'ccc'])
+        self.assertEqual(plugin.pack_lines([u'aaa', u'bbb'], 100),
+                         [u'aaa | bbb'])
+        self.assertEqual(plugin.pack_lines([], 100), [])
+
+    def testPackLinesCountsBytes(self):
+        # Three characters, but six bytes of UTF-8
+        self.assertEqual(plugin.pack_lines([u'\xe9\xe9\xe9', u'a'], 9),
+                         [u'\xe9\xe9\xe9', u'a'])
+
+    def testPackLinesLongPiece(self):
+        self.assertEqual(plugin.pack_lines([u'a', u'x' * 20, u'b'], 9),
+                         [u'a', u'x' * 20, u'b'])
+
+
+class RollingTimingsTestCase(SupyTestCase):
+    def testPercentiles(self):
+        timings = plugin.RollingTimings(100)
+        self.assertEqual(timings.percentiles('total'), None)
+        # Shuffled, and with a few too many, so the oldest get dropped
+        for value in range(-4, 1) + range(100, 0, -1):
+            timings.record(dict(total=value, sql=1))
+        self.assertEqual(len(timings), 100)
+        self.assertEqual(timings.percentiles('total'), [50, 95, 99])
+        self.assertEqual(timings.percentiles('total', (0, 1, 100)),
+                         [1, 1, 100])
+        self.assertEqual(timings.percentiles('lookup'), None)
+
+    def testFewSamples(self):
+        timings = plugin.RollingTimings(10)
+        timings.record(dict(total=3))
+        self.assertEqual(timings.percentiles('total'), [3, 3, 3])
+        timings.record(dict(total=1))
+        self.assertEqual(timings.percentiles('total'), [1, 3, 3])
+
+
+class FakeContext(object):
+    """Stands in for a LookupContext; the pool only ever rolls it back."""
+    def __init__(self):
+        self.db = self
+
+    def rollback(self):
+        pass
+
+class LookupPoolTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.stop()
+        SupyTestCase.tearDown(self)
+
+    def testInOrder(self):
+        self.pool = plugin.LookupPool(3, 10, FakeContext, None)
+        # Each job waits for the one after it, so they finish backwards
+        gates = [threading.Event() for _ in range(4)]
+        gates[-1].set()
+        delivered = []
+        done = threading.Event()
+
+        def job(i):
+            def run(context):
+                gates[i + 1].wait(5)
+                gates[i].set()
+                return i
+            return run
+
+        def deliver(result):
+            delivered.append(result)
+            if len(delivered) == 3:
+                done.set()
+
+        for i in range(3):
+            self.failUnless(self.pool.submit(job(i), deliver))
+        done.wait(5)
+        self.assertEqual(delivered, [0, 1, 2])
+
+    def testFull(self):
+        self.pool = plugin.LookupPool(1, 1, FakeContext, None)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(context):
+            started.set()
+            release.wait(5)
+
+        # One running, one waiting, and then no more
+        self.failUnless(self.pool.submit(block, lambda result: None))
+        started.wait(5)
+        self.failUnless(self.pool.submit(block, lambda result: None))
+        self.failIf(self.pool.submit(block, lambda result: None))
+        release.set()
+
+
+    def testSlowDelivery(self):
+        self.pool = plugin.LookupPool(1, 10, FakeContext, None)
+        delivering = threading.Event()
+        release = threading.Event()
+
+        def deliver(result):
+            delivering.set()
+            release.wait(5)
+
+        self.pool.submit(lambda context: None, deliver)
+        delivering.wait(5)
+        # A reply going out doesn't hold up new lookups
+        submitted = []
+        thread = threading.Thread(target=lambda: submitted.append(
+            self.pool.submit(lambda context: None, lambda result: None)))
+        thread.start()
+        thread.join(1)
+        self.assertEqual(submitted, [True])
+        release.set()
+
+
+class SnapshotTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        fd, self.path = tempfile.mkstemp(prefix='pokedex-snapshot-')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        SupyTestCase.tearDown(self)
+
+    def testRoundTrip(self):
+        records = dict((u'name:thing {0}'.format(i), u'=obj:{0}'.format(i))
+                       for i in range(1000))
+        records[u'name:flab\xe9b\xe9'] = u'>Did you mean: Flab\xe9b\xe9?'
+        snapshot.write_snapshot(self.path, records)
+
+        snap = snapshot.Snapshot(self.path)
+        try:
+            self.assertEqual(len(snap), len(records))
+            for key, value in records.iteritems():
+                self.assertEqual(snap.get(key), value)
+            self.assertEqual(snap.get(u'name:missingno'), None)
+        finally:
+            snap.close()
+
+    def testEmpty(self):
+        snapshot.write_snapshot(self.path, {})
+        snap = snapshot.Snapshot(self.path)
+        self.assertEqual(len(snap), 0)
+        self.assertEqual(snap.get(u'name:pikachu'), None)
+        snap.close()
+
+    def testNotASnapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write('\0' * 64)
+        self.assertRaises(ValueError, snapshot.Snapshot, self.path)
+
+
 class PokedexTestCase(PluginTestCase):
     plugins = ('Pokedex',)
+    # The snapshot goes in there before the plugin loads
+    cleanDataDir = False
+
+    def setUp(self):
+        # Served from a snapshot, so no database is needed
+        self.path = conf.supybot.directories.data.dirize('pokedex-test.snap')
+        snapshot.write_snapshot(self.path, {
+            u'name:pikachu': u'=obj:pokemon:25',
+            u'obj:pokemon:25': u'Pikachu: Electric',
+            u'name:metronome': u'>Did you mean: Metronome (move), '
+                               u'Metronome (item)?',
+        })
+        conf.supybot.plugins.Pokedex.snapshotFile.setValue('pokedex-test.snap')
+        conf.supybot.plugins.Pokedex.backgroundWarmup.setValue(False)
+        PluginTestCase.setUp(self)
+
+    def tearDown(self):
+        PluginTestCase.tearDown(self)
+        conf.supybot.plugins.Pokedex.snapshotFile.setValue('')
+        os.remove(self.path)
+
+    def testSnapshot(self):
+        self.assertResponse('pokedex Pikachu', 'Pikachu: Electric')
+        self.assertRegexp('pokedex metronome', 'Did you mean')
+        self.assertRegexp('pokedex missingno', "don't know what that is")
+        self.assertRegexp('pokedex pika*', "can't do fancy searches")
 
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -50,6 +50,16 @@ __contributors__ = {}
 __url__ = 'http://git.veekun.com/?p=dywypi.git;a=summary'
 
 import config
+import cache
+reload(cache)
+import kana
+reload(kana)
+import mirrors
+reload(mirrors)
+import edict
+reload(edict)
+import extract
+reload(extract)
 import plugin
 reload(plugin) # In case we're being reloaded.
 # Add more reloads here if you add third-party modules and want them to be
@@ -0,0 +1,180 @@
+###
+# Copyright (c) 2010, Alex Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Remembers what WWWJDIC said, on disk, so nobody has to ask it twice."""
+
+import sqlite3
+import threading
+import time
+
+schema = """
+    CREATE TABLE IF NOT EXISTS responses (
+        query TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        lines TEXT NOT NULL,
+        fetched REAL NOT NULL,
+        used REAL NOT NULL,
+        PRIMARY KEY (query, mode)
+    );
+    CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+
+class ResponseCache(object):
+    """Entry lines by query and search mode, in an sqlite database.
+
+    Anything older than `ttl` seconds is stale: still returned, but flagged
+    so it can be refetched.  Nothing is thrown away for being old, only for
+    being the least recently used once there are more than `max_entries`;
+    a stale answer beats none when WWWJDIC is down.  Safe to use from
+    several threads.  Once closed, it's empty and forgets whatever it's
+    given, so stragglers don't have to care.
+    """
+    def __init__(self, path, max_entries=10000, ttl=30 * 24 * 60 * 60,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.db.executescript(schema)
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def __len__(self):
+        with self.lock:
+            if self.db is None:
+                return 0
+            return self.db.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, query, mode):
+        """Returns (lines, fresh) for a query, or None if it's not cached."""
+        now = self.clock()
+        with self.lock:
+            if self.db is None:
+                return None
+            row = self.db.execute(
+                'SELECT lines, fetched FROM responses '
+                'WHERE query = ? AND mode = ?', (query, mode)).fetchone()
+            if row is None:
+                return None
+            with self.db:
+                self.db.execute(
+                    'UPDATE responses SET used = ? '
+                    'WHERE query = ? AND mode = ?', (now, query, mode))
+
+        lines, fetched = row
+        lines = lines.split(u'\n') if lines else []
+        return lines, now - fetched < self.ttl
+
+    def put(self, query, mode, lines):
+        now = self.clock()
+        with self.lock:
+            if self.db is None:
+                return
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO responses '
+                    '(query, mode, lines, fetched, used) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (query, mode, u'\n'.join(lines), now, now))
+
+                excess = self.db.execute(
+                    'SELECT COUNT(*) FROM responses').fetchone()[0] \
+                    - self.max_entries
+                if excess > 0:
+                    self.db.execute(
+                        'DELETE FROM responses WHERE rowid IN ('
+                        'SELECT rowid FROM responses ORDER BY used LIMIT ?)',
+                        (excess,))
+
+
+class Refresher(object):
+    """Refetches stale answers into a ResponseCache in background threads, no
+    more than one at a time for each query and mode.
+
+    `fetch(thing, mode)` returns the new lines.  Any of `errors` it raises
+    are logged and otherwise ignored, since the stale answer will still do.
+    """
+    def __init__(self, cache, fetch, log, errors=()):
+        self.cache = cache
+        self.fetch = fetch
+        self.log = log
+        self.errors = errors
+        self.lock = threading.Lock()
+        # (query, mode) => thread refetching it
+        self.pending = {}
+
+    def refresh(self, thing, query, mode):
+        """Starts refetching `thing`, cached as `query`.  Returns the thread
+        doing it, or None if one already is.
+        """
+        with self.lock:
+            if (query, mode) in self.pending:
+                return None
+            thread = threading.Thread(target=self._refresh,
+                                      args=(thing, query, mode),
+                                      name='wwwjdic-refresh')
+            thread.daemon = True
+            self.pending[query, mode] = thread
+        thread.start()
+        return thread
+
+    def join(self, timeout=None):
+        """Waits for the refetches under way to finish, for up to `timeout`
+        seconds in all.
+        """
+        with self.lock:
+            threads = self.pending.values()
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(0, deadline - time.time()))
+
+    def _refresh(self, thing, query, mode):
+        try:
+            self.cache.put(query, mode, self.fetch(thing, mode))
+        except self.errors:
+            # Still down, presumably
+            self.log.warning('Could not refresh %r from WWWJDIC.', thing)
+        finally:
+            with self.lock:
+                self.pending.pop((query, mode), None)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
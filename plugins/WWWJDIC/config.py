@@ -41,9 +41,43 @@ def configure(advanced):
 
 
 WWWJDIC = conf.registerPlugin('WWWJDIC')
-# This is where your configuration variables (if any) should go.  For example:
-# conf.registerGlobalValue(WWWJDIC, 'someConfigVariableName',
-#     registry.Boolean(False, """Help for someConfigVariableName."""))
+
+conf.registerGlobalValue(WWWJDIC, 'localDictionary',
+    registry.String('', """Path to a local EDICT or EDICT2 file.  If set,
+    words are looked up in it instead of asking WWWJDIC.  It's loaded the
+    first time it's needed, which takes a few seconds."""))
+
+conf.registerGlobalValue(WWWJDIC, 'localDictionaryEncoding',
+    registry.String('euc-jp', """Encoding of the local dictionary file.
+    EDICT is distributed as EUC-JP."""))
+
+conf.registerGlobalValue(WWWJDIC, 'cacheSize',
+    registry.PositiveInteger(10000, """Maximum number of WWWJDIC answers to
+    remember.  Past that, the least recently used are forgotten."""))
+
+conf.registerGlobalValue(WWWJDIC, 'cacheTTL',
+    registry.PositiveInteger(30 * 24 * 60 * 60, """Number of seconds a
+    remembered answer is good for.  Older ones are still used, but fetched
+    again in the background.  If WWWJDIC is down, they're used
+    regardless."""))
+
+conf.registerGlobalValue(WWWJDIC, 'mirrors',
+    registry.SpaceSeparatedListOfStrings([
+        'http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi',
+        'http://www.edrdg.org/cgi-bin/wwwjdic/wwwjdic',
+        'http://ryouko.imsb.nrc.ca/cgi-bin/wwwjdic',
+        'http://www.aa.tufs.ac.jp/~jwb/cgi-bin/wwwjdic.cgi',
+    ], """WWWJDIC mirrors to use, as URLs of the CGI script.  The fastest
+    working one is asked first."""))
+
+conf.registerGlobalValue(WWWJDIC, 'requestTimeout',
+    registry.PositiveFloat(5.0, """Number of seconds to wait for a mirror to
+    respond before giving up on it."""))
+
+conf.registerGlobalValue(WWWJDIC, 'hedgeDelay',
+    registry.PositiveFloat(0.5, """Number of seconds to wait for a mirror
+    before asking the next one too, or twice as long as it usually takes,
+    whichever is longer.  The first to answer wins."""))
 
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,233 @@
+# encoding: utf8
+###
+# Copyright (c) 2010, Alex Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""A local copy of EDICT, for looking words up without asking WWWJDIC.
+
+Reads EDICT or EDICT2 files, which look like:
+
+    KANJI;KANJI [KANA;KANA] /(pos) gloss/gloss/(P)/EntL1234567X/
+
+Every entry is indexed by its kanji, its kana, and its English glosses and
+the words in them.  Kana is indexed as hiragana, so either script finds it.
+Lookups work like WWWJDIC's: strict mode (1ZUR) only finds common words, the
+ones marked (P), and loose mode (1ZUQ) finds everything, common words first.
+"""
+
+from bisect import bisect_left
+import io
+import re
+
+from kana import to_hiragana
+
+# WWWJDIC's letters for the two search modes
+STRICT = 'R'
+LOOSE = 'Q'
+
+entry_re = re.compile(
+    ur'^(?P<words>[^ \[/]+)(?: \[(?P<readings>[^\]]*)\])? /(?P<glosses>.*)/$')
+# (P), (n), (ik), (1), (See ...) and friends
+tag_re = re.compile(ur'\([^)]*\)|\{[^}]*\}')
+gloss_word_re = re.compile(ur"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def is_japanese(string):
+    """Decides whether a query is Japanese rather than English."""
+    # wtf why is any() overridden
+    return bool(filter(lambda c: ord(c) > 256, string))
+
+
+def normalize_gloss(gloss):
+    """'(v5r,vi) to be (very) frightened' -> 'be frightened'"""
+    gloss = tag_re.sub(u' ', gloss).lower()
+    gloss = u' '.join(gloss.split())
+    if gloss.startswith(u'to '):
+        gloss = gloss[3:]
+    return gloss
+
+
+def _headwords(field):
+    """Splits a ;-separated kanji or kana field and drops the tags."""
+    if not field:
+        return []
+    return [tag_re.sub(u'', word).strip() for word in field.split(u';')]
+
+
+class Entry(object):
+    __slots__ = ('line', 'words', 'readings', 'glosses', 'common')
+
+    def __init__(self, line, words, readings, glosses, common):
+        # As shown to people, minus the EDICT2 entry number
+        self.line = line
+        self.words = words
+        self.readings = readings
+        self.glosses = glosses
+        self.common = common
+
+
+def parse_entry(line):
+    """Parses an EDICT line into an Entry, or returns None if it's not one
+    (e.g. the header).
+    """
+    line = line.strip()
+    # The header line is "？？？ /EDICT, EDICT_SUB(P).../"
+    if line.startswith(u'\uff1f\uff1f\uff1f'):
+        return None
+    match = entry_re.match(line)
+    if not match:
+        return None
+
+    glosses = match.group('glosses').split(u'/')
+    common = u'(P)' in glosses
+    if glosses and glosses[-1].startswith(u'EntL'):
+        glosses.pop()
+        line = line[:line.rindex(u'EntL')]
+
+    words = _headwords(match.group('words'))
+    readings = _headwords(match.group('readings'))
+    if not readings:
+        # Kana-only words are just written once
+        readings = words
+    glosses = [normalize_gloss(gloss) for gloss in glosses]
+    return Entry(line, words, readings,
+                 [gloss for gloss in glosses if gloss], common)
+
+
+def _add_posting(index, key, entry_id):
+    postings = index.setdefault(key, [])
+    # Entries are added in order, so a repeat can only be the last one
+    if not postings or postings[-1] != entry_id:
+        postings.append(entry_id)
+
+
+class Dictionary(object):
+    """EDICT, in memory."""
+    def __init__(self):
+        self.entries = []
+        # kanji or kana, in hiragana => entry ids
+        self.by_word = {}
+        # by_word's keys, sorted, for prefix searches; built when needed
+        self.sorted_words = None
+        # whole normalized gloss => entry ids
+        self.by_gloss = {}
+        # single English word => entry ids
+        self.by_gloss_word = {}
+
+    @classmethod
+    def load(cls, path, encoding='euc-jp'):
+        dictionary = cls()
+        with io.open(path, encoding=encoding, errors='replace') as f:
+            for line in f:
+                dictionary.add_line(line)
+        return dictionary
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_line(self, line):
+        """Adds an EDICT line.  Returns the Entry, or None if it wasn't
+        one.
+        """
+        entry = parse_entry(line)
+        if entry is None:
+            return None
+
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        for word in entry.words + entry.readings:
+            _add_posting(self.by_word, to_hiragana(word), entry_id)
+        self.sorted_words = None
+        for gloss in entry.glosses:
+            _add_posting(self.by_gloss, gloss, entry_id)
+            for word in gloss_word_re.findall(gloss):
+                _add_posting(self.by_gloss_word, word, entry_id)
+        return entry
+
+    def lookup(self, query, mode=STRICT, prefix=False):
+        """Returns the entries matching `query`, common words first.  In
+        STRICT mode, only common words are returned at all.
+
+        Japanese queries must match a headword or reading exactly, or just
+        start one if `prefix` is true.  English ones match a whole gloss if
+        possible, and otherwise any gloss containing all the words.
+        """
+        query = query.strip()
+        if is_japanese(query):
+            query = to_hiragana(query)
+            if prefix:
+                entry_ids = self._prefixed(query)
+            else:
+                entry_ids = self.by_word.get(query, [])
+        else:
+            query = normalize_gloss(query)
+            entry_ids = self.by_gloss.get(query) or self._all_words(query)
+
+        entries = [self.entries[entry_id] for entry_id in entry_ids]
+        common = [entry for entry in entries if entry.common]
+        if mode == STRICT:
+            return common
+        return common + [entry for entry in entries if not entry.common]
+
+    def _prefixed(self, query, limit=50):
+        """Entry ids for words starting with `query`, exact matches first,
+        and no more than `limit` of them.
+        """
+        if self.sorted_words is None:
+            self.sorted_words = sorted(self.by_word)
+
+        entry_ids = list(self.by_word.get(query, []))
+        seen = set(entry_ids)
+        i = bisect_left(self.sorted_words, query)
+        while i < len(self.sorted_words) and len(entry_ids) < limit:
+            word = self.sorted_words[i]
+            if not word.startswith(query):
+                break
+            for entry_id in self.by_word[word]:
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    entry_ids.append(entry_id)
+            i += 1
+        return entry_ids[:limit]
+
+    def _all_words(self, query):
+        words = gloss_word_re.findall(query)
+        if not words:
+            return []
+
+        # Start from the rarest word, so the set stays small
+        postings = sorted((self.by_gloss_word.get(word, []) for word in words),
+                          key=len)
+        entry_ids = set(postings[0])
+        for other in postings[1:]:
+            entry_ids.intersection_update(other)
+        return sorted(entry_ids)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,118 @@
+###
+# Copyright (c) 2010, Alex Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Pulls entries out of WWWJDIC's raw-mode pages as they download.
+
+Even the raw results come wrapped in minimal HTML.  They're just in this form
+though:
+
+    <pre>
+    entry 1
+    entry 2
+    </pre>
+
+so there's no need to parse the whole page; read up to the <pre>, hand back
+lines until the </pre> (or until we have enough), and stop.
+"""
+
+import codecs
+from HTMLParser import HTMLParser
+import httplib
+import re
+
+pre_start_re = re.compile(ur'<pre\b[^>]*>', re.IGNORECASE)
+pre_end_re = re.compile(ur'</pre\s*>', re.IGNORECASE)
+
+# What WWWJDIC says instead of a <pre> when it finds nothing
+no_results_markers = (u'No matches were found',)
+
+# How much of the page to hold on to while looking for <pre>, in case it's
+# split between reads
+_lookbehind = 64
+
+_unescape = HTMLParser().unescape
+
+
+class UnexpectedPage(httplib.HTTPException):
+    """The page had neither results nor a "no results" message -- a
+    maintenance notice or some such.  It's an HTTPException so that it's
+    treated like any other failed fetch: not cached, and not an answer.
+    """
+
+
+def extract_entries(response, limit=None, chunk_size=4096):
+    """Yields the lines in the first <pre> block of a response, reading as
+    little of it as possible.  Yields nothing if there are no results, and
+    raises UnexpectedPage if the page doesn't look like results at all.
+    """
+    decoder = codecs.getincrementaldecoder('utf8')('replace')
+    buffer = u''
+    in_pre = False
+    count = 0
+    while True:
+        chunk = response.read(chunk_size)
+        buffer += decoder.decode(chunk, final=not chunk)
+
+        if not in_pre:
+            match = pre_start_re.search(buffer)
+            if match:
+                in_pre = True
+                buffer = buffer[match.end():]
+            elif any(marker in buffer for marker in no_results_markers):
+                return
+            else:
+                buffer = buffer[-_lookbehind:]
+
+        if in_pre:
+            match = pre_end_re.search(buffer)
+            finished = match is not None or not chunk
+            if match:
+                buffer = buffer[:match.start()]
+            lines = buffer.split(u'\n')
+            # The last line may not be all here yet
+            buffer = u'' if finished else lines.pop()
+
+            for line in lines:
+                line = _unescape(line).strip()
+                if not line:
+                    continue
+                yield line
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+            if finished:
+                return
+
+        if not chunk:
+            raise UnexpectedPage('no <pre> or "no matches" in the page')
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,164 @@
+# encoding: utf8
+###
+# Copyright (c) 2010, Alex Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Converting roomaji to kana, and tidying up queries so that the same word
+typed different ways looks the same.
+"""
+
+import unicodedata
+
+# Roomaji => hiragana.  Hepburn, kunrei and the usual IME spellings all work
+_syllables = u"""
+    a あ  i い  u う  e え  o お
+    ka か  ki き  ku く  ke け  ko こ  kya きゃ  kyu きゅ  kyo きょ
+    ga が  gi ぎ  gu ぐ  ge げ  go ご  gya ぎゃ  gyu ぎゅ  gyo ぎょ
+    sa さ  shi し  si し  su す  se せ  so そ
+    sha しゃ  shu しゅ  sho しょ  she しぇ  sya しゃ  syu しゅ  syo しょ
+    za ざ  ji じ  zi じ  zu ず  ze ぜ  zo ぞ
+    ja じゃ  ju じゅ  jo じょ  je じぇ  jya じゃ  jyu じゅ  jyo じょ
+    zya じゃ  zyu じゅ  zyo じょ
+    ta た  chi ち  ti ち  tsu つ  tu つ  te て  to と
+    cha ちゃ  chu ちゅ  cho ちょ  che ちぇ  tya ちゃ  tyu ちゅ  tyo ちょ
+    da だ  di ぢ  du づ  de で  do ど  dya ぢゃ  dyu ぢゅ  dyo ぢょ
+    na な  ni に  nu ぬ  ne ね  no の  nya にゃ  nyu にゅ  nyo にょ
+    ha は  hi ひ  fu ふ  hu ふ  he へ  ho ほ  hya ひゃ  hyu ひゅ  hyo ひょ
+    fa ふぁ  fi ふぃ  fe ふぇ  fo ふぉ
+    ba ば  bi び  bu ぶ  be べ  bo ぼ  bya びゃ  byu びゅ  byo びょ
+    pa ぱ  pi ぴ  pu ぷ  pe ぺ  po ぽ  pya ぴゃ  pyu ぴゅ  pyo ぴょ
+    ma ま  mi み  mu む  me め  mo も  mya みゃ  myu みゅ  myo みょ
+    ya や  yu ゆ  yo よ
+    ra ら  ri り  ru る  re れ  ro ろ  rya りゃ  ryu りゅ  ryo りょ
+    la ら  li り  lu る  le れ  lo ろ
+    wa わ  wi ゐ  we ゑ  wo を
+    vu ゔ  va ゔぁ  vi ゔぃ  ve ゔぇ  vo ゔぉ
+    xa ぁ  xi ぃ  xu ぅ  xe ぇ  xo ぉ  xya ゃ  xyu ゅ  xyo ょ
+    xtsu っ  xtu っ  ltu っ  xwa ゎ
+    n' ん  - ー
+"""
+romaji_to_hiragana = dict(zip(*[iter(_syllables.split())] * 2))
+_longest_syllable = max(len(roomaji) for roomaji in romaji_to_hiragana)
+
+# ō and friends, as typed by people who know what they're doing
+_macrons = {u'ā': u'aa', u'ī': u'ii', u'ū': u'uu', u'ē': u'ee', u'ō': u'ou',
+            u'â': u'aa', u'î': u'ii', u'û': u'uu', u'ê': u'ee', u'ô': u'ou'}
+
+_hiragana_start = 0x3041
+_hiragana_end = 0x3096
+_katakana_offset = 0x60
+
+
+def roomaji_to_kana(roomaji, katakana=False):
+    """Converts roomaji to hiragana, or katakana if asked.  Anything that
+    isn't roomaji is left alone.
+    """
+    roomaji = u''.join(_macrons.get(c, c) for c in roomaji.lower())
+    kana = []
+    i = 0
+    while i < len(roomaji):
+        # nn is ん, but in konnichiha the second n starts a syllable
+        if roomaji.startswith(u'nn', i):
+            kana.append(u'ん')
+            if roomaji[i + 2:i + 3] and roomaji[i + 2] in u'aeiouy':
+                i += 1
+            else:
+                i += 2
+            continue
+
+        # Doubled consonants are a small tsu, except for nn
+        if (i + 1 < len(roomaji) and roomaji[i] == roomaji[i + 1]
+                and roomaji[i] not in u'aeioun-'
+                and roomaji[i].isalpha()):
+            kana.append(u'っ')
+            i += 1
+            continue
+        # ...as is tch, as in matcha
+        if roomaji.startswith(u'tch', i):
+            kana.append(u'っ')
+            i += 1
+            continue
+
+        for length in xrange(_longest_syllable, 0, -1):
+            syllable = roomaji[i:i + length]
+            if syllable in romaji_to_hiragana:
+                kana.append(romaji_to_hiragana[syllable])
+                i += length
+                break
+        else:
+            # n on its own, before a consonant or at the end
+            if roomaji[i] == u'n':
+                kana.append(u'ん')
+            else:
+                kana.append(roomaji[i])
+            i += 1
+
+    kana = u''.join(kana)
+    if katakana:
+        return to_katakana(kana)
+    return kana
+
+
+def to_katakana(string):
+    return u''.join(
+        unichr(ord(c) + _katakana_offset)
+        if _hiragana_start <= ord(c) <= _hiragana_end else c
+        for c in string)
+
+
+def to_hiragana(string):
+    return u''.join(
+        unichr(ord(c) - _katakana_offset)
+        if _hiragana_start <= ord(c) - _katakana_offset <= _hiragana_end
+        else c
+        for c in string)
+
+
+def normalize_query(query):
+    """Turns a query into the form it's looked up in: half- and full-width
+    characters folded with NFKC, whitespace collapsed, and @ or # roomaji
+    converted to hiragana or katakana respectively.
+    """
+    query = unicodedata.normalize('NFKC', query)
+    query = u' '.join(query.split())
+    if query[:1] == u'@':
+        query = roomaji_to_kana(query[1:].strip())
+    elif query[:1] == u'#':
+        query = roomaji_to_kana(query[1:].strip(), katakana=True)
+    return query
+
+
+def query_key(query):
+    """A key for a query that's the same however it was typed, in any
+    script or width.  Kana is folded to hiragana and English to lowercase.
+    """
+    return to_hiragana(normalize_query(query)).lower()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
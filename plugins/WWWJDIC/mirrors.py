@@ -0,0 +1,208 @@
+###
+# Copyright (c) 2010, Alex Munroe
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Asking several WWWJDIC mirrors at once, and keeping track of which ones
+are any good.
+"""
+
+import httplib
+import Queue
+import socket
+import threading
+import time
+import urllib2
+
+# Everything that can go wrong talking to WWWJDIC
+fetch_errors = (urllib2.URLError, httplib.HTTPException, socket.error)
+
+
+def in_background(func, *args):
+    """Runs func(*args) in a thread.  Returns a function that waits for it
+    and returns what it returned, or raises what it raised.
+    """
+    result = Queue.Queue(1)
+
+    def run():
+        try:
+            result.put((True, func(*args)))
+        except Exception as e:
+            result.put((False, e))
+
+    thread = threading.Thread(target=run, name='wwwjdic-background')
+    thread.daemon = True
+    thread.start()
+
+    def wait():
+        ok, value = result.get()
+        if ok:
+            return value
+        raise value
+    return wait
+
+
+class Mirror(object):
+    """One copy of WWWJDIC, and how it's been doing lately."""
+    __slots__ = ('url', 'latency', 'failures', 'demoted_until')
+
+    def __init__(self, url):
+        self.url = url
+        # Moving average of how long it takes to answer, in seconds
+        self.latency = None
+        # In a row
+        self.failures = 0
+        self.demoted_until = 0
+
+
+class MirrorPool(object):
+    """Fetches from whichever mirror answers first.
+
+    Requests go to the best mirror first.  If it hasn't answered within
+    `hedge_delay` seconds (or twice its usual time, if that's longer), or
+    it fails, the next best is asked as well, and so on; the first answer
+    wins.  Mirrors are ranked by average latency, and any that fail
+    `max_failures` times in a row are tried last for `demotion` seconds.
+    """
+    # Weight given to each new latency measurement
+    smoothing = 0.3
+
+    def __init__(self, urls, timeout=5.0, hedge_delay=0.5, max_failures=3,
+                 demotion=300, clock=time.time):
+        self.urls = list(urls)
+        self.mirrors = [Mirror(url) for url in urls]
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.max_failures = max_failures
+        self.demotion = demotion
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def ranked(self):
+        """Returns the mirrors, best first."""
+        now = self.clock()
+        with self.lock:
+            # Untried mirrors go before slow ones; they might be fast
+            return sorted(self.mirrors, key=lambda mirror: (
+                mirror.demoted_until > now,
+                mirror.latency or 0,
+            ))
+
+    def _succeeded(self, mirror, elapsed):
+        with self.lock:
+            if mirror.latency is None:
+                mirror.latency = elapsed
+            else:
+                mirror.latency += self.smoothing * (elapsed - mirror.latency)
+            mirror.failures = 0
+            mirror.demoted_until = 0
+
+    def _failed(self, mirror):
+        with self.lock:
+            mirror.failures += 1
+            if mirror.failures >= self.max_failures:
+                mirror.demoted_until = self.clock() + self.demotion
+
+    def _attempt(self, mirror, path, read, results):
+        started = self.clock()
+        try:
+            response = urllib2.urlopen(mirror.url + path,
+                                       timeout=self.timeout)
+            try:
+                value = read(response)
+            finally:
+                response.close()
+        except fetch_errors as e:
+            self._failed(mirror)
+            results.put((False, e))
+            return
+        except Exception as e:
+            # Probably a bug in read() rather than the mirror's fault, but
+            # fetch() is still waiting to hear about it
+            results.put((False, e))
+            return
+        self._succeeded(mirror, self.clock() - started)
+        results.put((True, value))
+
+    def _start(self, mirror, path, read, results):
+        """Asks a mirror in a thread.  Returns how long to give it before
+        asking another one too.
+        """
+        thread = threading.Thread(target=self._attempt,
+                                  args=(mirror, path, read, results),
+                                  name='wwwjdic-fetch')
+        thread.daemon = True
+        thread.start()
+        return max(self.hedge_delay, 2 * (mirror.latency or 0))
+
+    def fetch(self, path, read):
+        """Fetches `path` (everything after the mirror's URL) and returns
+        read(response), from the first mirror to manage it.  Raises the last
+        error if none do, or URLError if none have answered `timeout` seconds
+        after the last one was asked.
+        """
+        mirrors = self.ranked()
+        if not mirrors:
+            raise urllib2.URLError('no WWWJDIC mirrors configured')
+
+        results = Queue.Queue()
+        pending = 0
+        error = None
+        deadline = None
+        while True:
+            # Ask the next mirror: to begin with, when the last one is taking
+            # too long, or when one has failed
+            if mirrors:
+                delay = self._start(mirrors.pop(0), path, read, results)
+                pending += 1
+                if not mirrors:
+                    deadline = time.time() + self.timeout
+            elif not pending:
+                raise error
+
+            if mirrors:
+                wait = delay
+            else:
+                # The socket timeout only bounds each read, and a mirror
+                # dribbling out a byte at a time would never trip it
+                wait = deadline - time.time()
+                if wait <= 0:
+                    raise urllib2.URLError(
+                        'no WWWJDIC mirror answered in time')
+            try:
+                ok, value = results.get(timeout=wait)
+            except Queue.Empty:
+                continue
+
+            pending -= 1
+            if ok:
+                return value
+            error = value
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
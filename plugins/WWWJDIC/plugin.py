@@ -28,15 +28,22 @@
 
 ###
 
+import supybot.conf as conf
 import supybot.utils as utils
 from supybot.commands import *
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
 
+import threading
+import time
 import urllib
-import urllib2
-from BeautifulSoup import BeautifulSoup, NavigableString
+
+from cache import Refresher, ResponseCache
+import edict
+from extract import extract_entries
+from kana import normalize_query, query_key
+from mirrors import MirrorPool, fetch_errors, in_background
 
 
 def urlencode(string):
@@ -48,6 +55,31 @@ class WWWJDIC(callbacks.Plugin):
     This should describe *how* to use this plugin."""
     threaded = True
 
+    def __init__(self, irc):
+        self.__parent = super(WWWJDIC, self)
+        self.__parent.__init__(irc)
+
+        # The local dictionary, if any, is loaded on first use
+        self.dictionary = None
+        self.dictionary_path = None
+        self.dictionary_lock = threading.Lock()
+
+        # What WWWJDIC has told us before.  Stale answers are refetched in
+        # the background, one thread per query at most
+        self.cache = ResponseCache(
+            conf.supybot.directories.data.dirize('wwwjdic-cache.sqlite'),
+            self.registryValue('cacheSize'), self.registryValue('cacheTTL'))
+        self.refresher = Refresher(self.cache, self._fetch, self.log,
+                                   fetch_errors)
+
+        self.mirror_pool = None
+
+    def die(self):
+        # Anything still refetching after this just goes unsaved
+        self.refresher.join(self.registryValue('requestTimeout'))
+        self.cache.close()
+        self.__parent.die()
+
     def jdic(self, irc, msg, args, thing):
         """<thing...>
 
@@ -62,45 +94,27 @@ class WWWJDIC(callbacks.Plugin):
             except UnicodeDecodeError:
                 thing = ascii_thing.decode('latin1')
 
+        # Half-width kana, roomaji and so on all become plain old kana
+        thing = normalize_query(thing)
+        if not thing:
+            irc.reply("Look up what?")
+            return
 
-        # Unnngh this is horrendous.  urllib doesn't understand unicode at all;
-        # manually encode as bytes and then urlencode
-        url_thing = urllib.quote(thing.encode('utf8'))
+        try:
+            entries = self._lookup(thing)
+        except fetch_errors:
+            self.log.exception('Could not reach WWWJDIC.')
+            irc.reply("WWWJDIC isn't answering, and I don't remember that "
+                      "one.  Try again later?")
+            return
 
-        # Hit up wwwjdic
-        # 1 = edict; Z = raw results; U = utf8 input; R = exact + common
-        res = urllib2.urlopen(
-            u"http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi?1ZUR"
-            + url_thing
-        )
-
-        # Even the raw results come wrapped in minimal HTML.  This sucks.
-        # They're just in this form though:
-        # <pre>
-        # entry 1
-        # entry 2
-        # So grab everything from that pre tag, split by lines, and spit it
-        # back out.
-        soup = BeautifulSoup(res)
-        if not soup.pre:
-            # Nothing found!  Try again but allow non-P words
-            res = urllib2.urlopen(
-                u"http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi?1ZUQ"
-                + url_thing
-            )
-            soup = BeautifulSoup(res)
-
-        if not soup.pre:
+        if not entries:
             # Still nothing.  Bail.
             reply = u"Hmm, I can't figure out what that means.  " \
                 "Perhaps try denshi jisho directly: "
 
             jisho_url = u"http://jisho.org/words?jap={jap}&eng={eng}&dict=edict"
-            if thing[0] in ('@', '#'):
-                # Prefixes for roomaji
-                reply += jisho_url.format(jap=urlencode(thing[1:]), eng=u'')
-            # wtf why is any() overridden
-            elif filter(lambda c: ord(c) > 256, thing):
+            if edict.is_japanese(thing):
                 reply += jisho_url.format(jap=urlencode(thing), eng=u'')
             else:
                 reply += jisho_url.format(jap=u'', eng=urlencode(thing))
@@ -108,22 +122,115 @@ class WWWJDIC(callbacks.Plugin):
             self._reply(irc, reply)
             return
 
-        thing_ct = 0
-        for entry in soup.pre.string.splitlines():
-            entry = entry.strip()
-            if entry == '':
-                continue
-
+        # Don't send back more than three; that's probably plenty
+        for entry in entries[:3]:
             self._reply(irc, entry)
 
-            # Don't send back more than three; that's probably plenty
-            thing_ct += 1
-            if thing_ct >= 3:
-                break
-
     jdic = wrap(jdic, [rest('something')])
 
 
+    def _lookup(self, thing):
+        """Returns the EDICT lines for `thing`, which should already have
+        been through normalize_query(): common words if there are any,
+        otherwise everything, and failing that, anything starting with
+        `thing`.  Uses the local dictionary if there is one.
+        """
+        dictionary = self._dictionary()
+        if dictionary is None:
+            return self._remoteLookup(thing)
+
+        entries = dictionary.lookup(thing, edict.STRICT) \
+            or dictionary.lookup(thing, edict.LOOSE) \
+            or dictionary.lookup(thing, edict.LOOSE, prefix=True)
+        return [entry.line for entry in entries]
+
+    def _remoteLookup(self, thing):
+        # Common words are preferred, but if there aren't any, there's no
+        # sense waiting to find that out before asking for non-P words too
+        cached = self.cache.get(query_key(thing), 'R')
+        if cached is not None and cached[0]:
+            return self._cachedFetch(thing, 'R')
+
+        loose = in_background(self._cachedFetch, thing, 'Q')
+        try:
+            strict = self._cachedFetch(thing, 'R')
+        except fetch_errors:
+            # The loose answer will still do, if there is one
+            self.log.warning('Could not look up %r in strict mode.', thing)
+            strict = None
+        return strict or loose()
+
+    def _cachedFetch(self, thing, mode):
+        """Returns _fetch()'s answer, from the cache if possible.  Stale
+        answers are still returned, but refreshed in the background.
+        """
+        # Same key for the same word however it was typed
+        key = query_key(thing)
+        self.cache.max_entries = self.registryValue('cacheSize')
+        self.cache.ttl = self.registryValue('cacheTTL')
+        cached = self.cache.get(key, mode)
+        if cached is None:
+            entries = self._fetch(thing, mode)
+            self.cache.put(key, mode, entries)
+            return entries
+
+        entries, fresh = cached
+        if not fresh:
+            self.refresher.refresh(thing, key, mode)
+        return entries
+
+    def _fetch(self, thing, mode):
+        """Asks WWWJDIC about `thing`, in search mode R (exact and common)
+        or Q (exact).  Returns a list of up to three EDICT lines.
+        """
+        # Unnngh this is horrendous.  urllib doesn't understand unicode at all;
+        # manually encode as bytes and then urlencode
+        url_thing = urllib.quote(thing.encode('utf8'))
+
+        # Hit up wwwjdic, or whichever copy of it is quickest
+        # 1 = edict; Z = raw results; U = utf8 input; R = exact + common
+        # Even the raw results come wrapped in minimal HTML, but nothing past
+        # the first three entries is ever shown, so stop reading there
+        return self._mirrorPool().fetch(
+            u'?1ZU' + mode + url_thing,
+            lambda res: list(extract_entries(res, limit=3)))
+
+    def _mirrorPool(self):
+        """Returns the MirrorPool, rebuilding it if the list of mirrors has
+        changed.
+        """
+        urls = self.registryValue('mirrors')
+        if self.mirror_pool is None or self.mirror_pool.urls != urls:
+            self.mirror_pool = MirrorPool(urls)
+        self.mirror_pool.timeout = self.registryValue('requestTimeout')
+        self.mirror_pool.hedge_delay = self.registryValue('hedgeDelay')
+        return self.mirror_pool
+
+    def _dictionary(self):
+        """Returns the local edict.Dictionary, loading it the first time, or
+        None if there isn't one.
+        """
+        path = self.registryValue('localDictionary')
+        if not path:
+            return None
+
+        with self.dictionary_lock:
+            # Only try once per path, rather than on every lookup
+            if path != self.dictionary_path:
+                self.dictionary_path = path
+                self.dictionary = None
+                started = time.time()
+                try:
+                    self.dictionary = edict.Dictionary.load(
+                        path, self.registryValue('localDictionaryEncoding'))
+                except (IOError, LookupError):
+                    self.log.exception('Could not load the local dictionary '
+                                       'from %s; using WWWJDIC instead.', path)
+                else:
+                    self.log.info('Loaded %d EDICT entries in %.1fs.',
+                                  len(self.dictionary), time.time() - started)
+            return self.dictionary
+
     def _reply(self, irc, response):
         """Wraps irc.reply() to do some Unicode decoding.
 
@@ -1,3 +1,4 @@
+# encoding: utf8
 ###
 # Copyright (c) 2010, Alex Munroe
 # All rights reserved.
@@ -28,10 +29,359 @@
 
 ###
 
+import BaseHTTPServer
+import os
+import SocketServer
+from StringIO import StringIO
+import tempfile
+import threading
+import time
+
 from supybot.test import *
 
+import cache
+import edict
+import extract
+import kana
+import mirrors
+
+# A few EDICT2 lines, to stand in for WWWJDIC
+fixture = u"""\
+　？？？ /EDICT, EDICT_SUB(P), EDICT_SUB/Japanese-English Electronic Dictionary Files/
+漢字 [かんじ] /(n) Chinese characters/kanji/(P)/EntL1326900X/
+感じ [かんじ] /(n) feeling/sense/impression/(P)/EntL1220900X/
+幹事 [かんじ] /(n) executive/manager/secretary/EntL1218840X/
+猫;ネコ [ねこ] /(n) (1) cat/(2) shamisen/(P)/EntL1467640X/
+怖がる [こわがる] /(v5r,vi) to be afraid of/to fear/to dread/(P)/EntL1593070X/
+"""
+
+def write_fixture():
+    """Writes the fixture to a temporary file, as EUC-JP like the real
+    thing, and returns its path.  Remove it when done.
+    """
+    fd, path = tempfile.mkstemp(prefix='edict-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(fixture.encode('euc-jp'))
+    return path
+
+
+class EdictTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        path = write_fixture()
+        try:
+            self.dictionary = edict.Dictionary.load(path)
+        finally:
+            os.remove(path)
+
+    def lines(self, query, mode, prefix=False):
+        return [entry.line for entry in
+                self.dictionary.lookup(query, mode, prefix)]
+
+    def testHeaderIsSkipped(self):
+        self.assertEqual(len(self.dictionary), 5)
+
+    def testStrictIsCommonOnly(self):
+        self.assertEqual(self.lines(u'かんじ', edict.STRICT), [
+            u'漢字 [かんじ] /(n) Chinese characters/kanji/(P)/',
+            u'感じ [かんじ] /(n) feeling/sense/impression/(P)/',
+        ])
+        self.assertEqual(self.lines(u'secretary', edict.STRICT), [])
+
+    def testLooseHasCommonFirst(self):
+        self.assertEqual(len(self.lines(u'かんじ', edict.LOOSE)), 3)
+        self.assertEqual(self.lines(u'secretary', edict.LOOSE),
+                         [u'幹事 [かんじ] /(n) executive/manager/secretary/'])
+
+    def testKanjiAndKana(self):
+        self.assertEqual(self.lines(u'猫', edict.STRICT),
+                         self.lines(u'ネコ', edict.STRICT))
+        self.assertEqual(self.lines(u'猫', edict.STRICT),
+                         self.lines(u'ねこ', edict.STRICT))
+
+    def testEnglish(self):
+        # Whole glosses, ignoring "to" and tags
+        self.assertEqual(len(self.lines(u'fear', edict.STRICT)), 1)
+        self.assertEqual(len(self.lines(u'cat', edict.STRICT)), 1)
+        # Failing that, any gloss with all the words
+        self.assertEqual(len(self.lines(u'afraid', edict.STRICT)), 1)
+        self.assertEqual(len(self.lines(u'afraid cat', edict.STRICT)), 0)
+
+    def testEitherKana(self):
+        self.assertEqual(self.lines(u'ネコ', edict.STRICT),
+                         self.lines(u'ねこ', edict.STRICT))
+        self.assertEqual(self.lines(u'コワガル', edict.STRICT),
+                         self.lines(u'こわがる', edict.STRICT))
+
+    def testPrefix(self):
+        self.assertEqual(self.lines(u'こわ', edict.LOOSE), [])
+        self.assertEqual(len(self.lines(u'こわ', edict.LOOSE, True)), 1)
+        self.assertEqual(len(self.lines(u'かん', edict.LOOSE, True)), 3)
+
+
+class KanaTestCase(SupyTestCase):
+    def testRoomaji(self):
+        for roomaji, hiragana in [
+                (u'neko', u'ねこ'), (u'toukyou', u'とうきょう'),
+                (u'tōkyō', u'とうきょう'), (u'kitte', u'きって'),
+                (u'matcha', u'まっちゃ'), (u'shinbun', u'しんぶん'),
+                (u"kon'ya", u'こんや'), (u'konnichiha', u'こんにちは'),
+                (u'onna', u'おんな'), (u'tsukue', u'つくえ'),
+                (u'jyuu', u'じゅう'), (u'hon', u'ほん')]:
+            self.assertEqual(kana.roomaji_to_kana(roomaji), hiragana)
+
+        self.assertEqual(kana.roomaji_to_kana(u'ko-hi-', katakana=True),
+                         u'コーヒー')
+
+    def testNormalizeQuery(self):
+        self.assertEqual(kana.normalize_query(u'@neko'), u'ねこ')
+        self.assertEqual(kana.normalize_query(u'#kamera'), u'カメラ')
+        # Half-width katakana and full-width ASCII
+        self.assertEqual(kana.normalize_query(u'ｶﾒﾗ'), u'カメラ')
+        self.assertEqual(kana.normalize_query(u'ｃａｔ  food '), u'cat food')
+
+    def testQueryKey(self):
+        self.assertEqual(kana.query_key(u'#neko'), kana.query_key(u'ねこ'))
+        self.assertEqual(kana.query_key(u'ﾈｺ'), kana.query_key(u'@neko'))
+        self.assertEqual(kana.query_key(u'Cat'), kana.query_key(u'cat'))
+
+
+class WarningLog(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, *args):
+        self.warnings.append(args)
+
+class CacheTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        fd, self.path = tempfile.mkstemp(prefix='wwwjdic-cache-')
+        os.close(fd)
+        self.now = 1000.0
+        self.cache = cache.ResponseCache(self.path, max_entries=2, ttl=60,
+                                         clock=lambda: self.now)
+
+    def tearDown(self):
+        self.cache.close()
+        os.remove(self.path)
+        SupyTestCase.tearDown(self)
+
+    def testFreshness(self):
+        self.assertEqual(self.cache.get(u'ねこ', 'R'), None)
+        self.cache.put(u'ねこ', 'R', [u'猫 [ねこ] /(n) cat/'])
+        self.cache.put(u'ねこ', 'Q', [])
+        self.now += 59
+        self.assertEqual(self.cache.get(u'ねこ', 'R'),
+                         ([u'猫 [ねこ] /(n) cat/'], True))
+        self.assertEqual(self.cache.get(u'ねこ', 'Q'), ([], True))
+
+        # Stale, but still there
+        self.now += 2
+        self.assertEqual(self.cache.get(u'ねこ', 'R'),
+                         ([u'猫 [ねこ] /(n) cat/'], False))
+
+    def testEviction(self):
+        self.cache.put(u'a', 'R', [u'a'])
+        self.now += 1
+        self.cache.put(u'b', 'R', [u'b'])
+        self.now += 1
+        self.cache.get(u'a', 'R')
+        self.now += 1
+        self.cache.put(u'c', 'R', [u'c'])
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get(u'b', 'R'), None)
+        self.assertEqual(self.cache.get(u'a', 'R'), ([u'a'], True))
+
+    def testRefreshOnce(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        def fetch(thing, mode):
+            calls.append((thing, mode))
+            started.set()
+            release.wait(5)
+            if thing == u'down':
+                raise IOError
+            return [thing + u' again']
+
+        log = WarningLog()
+        refresher = cache.Refresher(self.cache, fetch, log, (IOError,))
+        thread = refresher.refresh(u'ねこ', u'ねこ', 'R')
+        started.wait(5)
+        # Already being taken care of
+        self.assertEqual(refresher.refresh(u'ネコ', u'ねこ', 'R'), None)
+        release.set()
+        thread.join(5)
+        self.assertEqual(calls, [(u'ねこ', 'R')])
+        self.assertEqual(self.cache.get(u'ねこ', 'R'),
+                         ([u'ねこ again'], True))
+
+        # Once it's done, it can happen again; failures keep the old answer
+        self.cache.put(u'down', 'R', [u'old'])
+        refresher.refresh(u'down', u'down', 'R').join(5)
+        self.assertEqual(self.cache.get(u'down', 'R'), ([u'old'], True))
+        self.assertEqual(len(log.warnings), 1)
+        self.assert_(refresher.refresh(u'ねこ', u'ねこ', 'R') is not None)
+        refresher.join(5)
+
+    def testClosed(self):
+        self.cache.put(u'a', 'R', [u'a'])
+        self.cache.close()
+        # Late refetches and lookups are harmless
+        self.cache.put(u'b', 'R', [u'b'])
+        self.assertEqual(self.cache.get(u'a', 'R'), None)
+        self.assertEqual(len(self.cache), 0)
+
+
+class ExtractTestCase(SupyTestCase):
+    page = u"""<HTML><BODY>
+<PRE>
+猫;ネコ [ねこ] /(n) cat/(P)/
+
+犬 [いぬ] /(n) dog &amp; co/(P)/
+三 [さん] /(num) three/(P)/
+四 [し] /(num) four/(P)/
+</pre>
+</BODY></HTML>""".encode('utf8')
+
+    def testEntries(self):
+        # Tiny reads, to split tags and characters between them
+        for chunk_size in (1, 3, 4096):
+            entries = list(extract.extract_entries(
+                StringIO(self.page), chunk_size=chunk_size))
+            self.assertEqual(len(entries), 4)
+            self.assertEqual(entries[1], u'犬 [いぬ] /(n) dog & co/(P)/')
+
+    def testStopsEarly(self):
+        response = StringIO(self.page)
+        entries = list(extract.extract_entries(response, limit=2,
+                                               chunk_size=16))
+        self.assertEqual(len(entries), 2)
+        self.assert_(response.tell() < len(self.page))
+
+    def testNoResults(self):
+        response = StringIO('<HTML>No matches were found for this key'
+                            + ' ' * 10000)
+        self.assertEqual(list(extract.extract_entries(response)), [])
+        self.assert_(response.tell() < 10000)
+
+    def testUnexpectedPage(self):
+        response = StringIO('<HTML>Down for maintenance</HTML>')
+        self.assertRaises(extract.UnexpectedPage, list,
+                          extract.extract_entries(response))
+        self.assert_(issubclass(extract.UnexpectedPage, mirrors.fetch_errors))
+
+
+class MirrorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Pretends to be a few WWWJDIC mirrors of varying quality."""
+    def do_GET(self):
+        mirror = self.path.split('?')[0]
+        if mirror == '/broken':
+            self.send_error(500)
+            return
+        if mirror == '/slow':
+            time.sleep(1)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(mirror)
+
+    def log_message(self, *args):
+        pass
+
+class MirrorServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class MirrorsTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = MirrorServer(('127.0.0.1', 0), MirrorHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
+    def pool(self, *names, **kwargs):
+        base = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        return mirrors.MirrorPool([base + name for name in names], **kwargs)
+
+    def fetch(self, pool):
+        return pool.fetch('?1ZUR', lambda response: response.read())
+
+    def testHedging(self):
+        pool = self.pool('slow', 'fast', hedge_delay=0.1)
+        started = time.time()
+        self.assertEqual(self.fetch(pool), '/fast')
+        self.assert_(time.time() - started < 0.9)
+
+    def testFailover(self):
+        pool = self.pool('broken', 'fast')
+        self.assertEqual(self.fetch(pool), '/fast')
+
+    def testDemotion(self):
+        pool = self.pool('broken', 'fast', max_failures=2)
+        for _ in range(2):
+            pool._failed(pool.mirrors[0])
+        self.assertEqual([mirror.url.rsplit('/', 1)[1]
+                          for mirror in pool.ranked()], ['fast', 'broken'])
+
+    def testTimeout(self):
+        pool = self.pool('slow', timeout=0.2)
+        self.assertRaises(mirrors.fetch_errors, self.fetch, pool)
+
+    def testDeadline(self):
+        # A read that takes forever without the socket ever timing out
+        pool = self.pool('fast', timeout=0.2)
+        started = time.time()
+        self.assertRaises(mirrors.fetch_errors, pool.fetch, '?1ZUR',
+                          lambda response: time.sleep(1))
+        self.assert_(time.time() - started < 0.9)
+
+    def testReadError(self):
+        pool = self.pool('fast', timeout=0.2)
+        self.assertRaises(ZeroDivisionError, pool.fetch, '?1ZUR',
+                          lambda response: 1 / 0)
+        self.assertEqual(pool.mirrors[0].failures, 0)
+
+    def testAllBroken(self):
+        pool = self.pool('broken', 'broken')
+        self.assertRaises(mirrors.fetch_errors, self.fetch, pool)
+
+    def testInBackground(self):
+        self.assertEqual(mirrors.in_background(sum, [1, 2])(), 3)
+        self.assertRaises(ZeroDivisionError,
+                          mirrors.in_background(lambda: 1 / 0))
+
+
 class WWWJDICTestCase(PluginTestCase):
     plugins = ('WWWJDIC',)
 
+    def setUp(self):
+        self.fixture_path = write_fixture()
+        conf.supybot.plugins.WWWJDIC.localDictionary.setValue(
+            self.fixture_path)
+        PluginTestCase.setUp(self)
+
+    def tearDown(self):
+        PluginTestCase.tearDown(self)
+        os.remove(self.fixture_path)
+
+    def testLocalLookup(self):
+        self.assertResponse('jdic cat',
+            u'猫;ネコ [ねこ] /(n) (1) cat/(2) shamisen/(P)/'.encode('utf8'))
+        self.assertRegexp('jdic secretary', 'executive')
+        self.assertRegexp('jdic xyzzy', "can't figure out")
+
+    def testRoomajiLookup(self):
+        self.assertRegexp('jdic @neko', 'shamisen')
+        self.assertRegexp('jdic #neko', 'shamisen')
+        self.assertRegexp(u'jdic ﾈｺ', 'shamisen')
+        self.assertRegexp('jdic @kowa', 'afraid')
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: